@@ -0,0 +1,685 @@
+import interpreter
+import builtin
+import lattice
+import parse
+
+# inference over types instead of values: every phrase is evaluated once per
+# pass, both sides of every branch included, and loop bodies are rerun until
+# the recorded types stop changing; names keep one type per scope, as in LIB
+
+# after this many changes a name holding a tuple is widened to a list, so
+# tuples nested in tuples cannot grow forever
+WIDEN = 8
+LOOPS = 16
+PASSES = 64
+
+FUNCTIONS = {}
+CLASSES = {}
+INSTANCES = {}
+MODULES = {}
+REFS = {}
+CHANGES = {}
+PASS = 0
+
+class Ref:
+    def __init__(self, v):
+        self.v = v
+
+class Opaque:
+    # builtin values that have no type of their own: methods, views, slices
+    def __init__(self, name, receiver=None, method=None, element=None):
+        self.name = name
+        self.receiver = receiver
+        self.method = method
+        self.element = element
+
+    def call(self, args):
+        if self.method is None:
+            return None
+        return self.method(self.receiver, args)
+
+class Env:
+    def __init__(self, scope_id, parent, names):
+        self.scope_id = scope_id
+        self.parent = parent
+        self.names = names
+        self.casts = {}
+
+    def owner(self, name):
+        types = interpreter.LIB.types.get(self.scope_id, {})
+        if name in self.casts or name in types or name in self.names:
+            return self
+        if self.parent is not None:
+            return self.parent.owner(name)
+        return None
+
+    def find(self, name):
+        if name in self.casts:
+            return self.casts[name]
+
+        types = interpreter.LIB.types.get(self.scope_id, {})
+        if name in types:
+            return value_of(self.scope_id, name, types[name])
+        if name in self.names:
+            return None
+        if self.parent is not None:
+            return self.parent.find(name)
+        return BUILTINS.get(name)
+
+class Function:
+    def __init__(self, phrases, i, args, env):
+        self.phrases = phrases
+        self.i = i
+        self.env = env
+        self.scope_id = phrases[i - 1].tree.phrase_id
+        self.args = [a[1] for a in args]
+        self.casts = [a[0] + ':' if a[0] else None for a in args]
+        self.names = interpreter.frame_layout(phrases, i, phrases[i - 1].end, args)
+        self.is_generator = phrases[i - 1].has_yield
+        self.returns = any(phrase.name == 'return' and phrase.tree is not None
+                           for phrase in interpreter.block_phrases(phrases, i, phrases[i - 1].end))
+        self.analyzed = -1
+
+def progress():
+    return interpreter.LIB.version + builtin.Types.version
+
+def typeof(value, depth=0):
+    if type(value) == lattice.Type:
+        return value
+    if type(value) == tuple:
+        items = tuple([typeof(v, depth + 1) for v in value])
+        if None in items:
+            return None
+        return lattice.tuple_of(items, depth)
+    if type(value) == Ref:
+        return lattice.REF
+    return None
+
+def shape(tp):
+    if tp is None or tp.kind != 'tuple':
+        return tp
+    return tuple([shape(item) for item in tp.items])
+
+def value_of(scope_id, name, tp):
+    if tp is lattice.REF:
+        return Ref(REFS.get((scope_id, name)))
+    return shape(tp)
+
+def join(a, b):
+    if a is None:
+        return b
+    if b is None or a is b:
+        return a
+    if type(a) == Ref and type(b) == Ref:
+        return Ref(join(a.v, b.v))
+
+    t1, t2 = typeof(a), typeof(b)
+    if t1 is None or t2 is None:
+        return a
+    tp = lattice.merge(t1, t2)
+    if tp is None:
+        raise interpreter.CouldNotMergeTypes(t1, t2)
+    return shape(tp)
+
+def widened(tp):
+    if tp.kind == 'tuple':
+        return lattice.LIST
+    return tp
+
+def record(scope_id, name, value):
+    tp = typeof(value)
+    if tp is None:
+        return
+    if type(value) == Ref:
+        REFS[(scope_id, name)] = join(REFS.get((scope_id, name)), value.v)
+
+    lib = interpreter.LIB
+    before = lib.version
+    lib.update_type(scope_id, name, tp)
+    if lib.version == before:
+        return
+
+    key = (scope_id, name)
+    CHANGES[key] = CHANGES.get(key, 0) + 1
+    if CHANGES[key] > WIDEN:
+        lib.replace_type(scope_id, name, widened(lib.types[scope_id][name]))
+
+def record_item(name, value):
+    tp = typeof(value)
+    if tp is None:
+        return
+
+    old = builtin.Types.types.get(name)
+    if old is not None:
+        tp = lattice.merge(old, tp)
+        if tp is None:
+            raise interpreter.CouldNotMergeTypes(old, typeof(value))
+    if tp is not old:
+        builtin.Types.types[name] = tp
+        builtin.Types.version += 1
+
+def item(name):
+    return shape(builtin.Types.types.get(name))
+
+def element(value):
+    if value is None:
+        return None
+    if type(value) == tuple:
+        result = None
+        for v in value:
+            result = join(result, v)
+        return result
+    if type(value) == Opaque:
+        return value.element
+    if type(value) != lattice.Type:
+        return None
+
+    if value.kind == 'str':
+        return lattice.CHAR
+    if value.kind == 'list':
+        return item('list_items:' + value.payload)
+    if value.kind == 'dict':
+        return item('dict_keys:' + value.payload)
+    if value.kind == 'set':
+        return item('set_elements:' + value.payload)
+    if value is lattice.RANGE:
+        return lattice.DOUBLE
+    if value.kind == 'generator':
+        return shape(interpreter.LIB.types.get(value.payload, {}).get(''))
+    return None
+
+def instance_env(class_id):
+    if class_id not in INSTANCES:
+        if class_id not in CLASSES:
+            return None
+        INSTANCES[class_id] = Env(class_id + '[instance]', CLASSES[class_id], {})
+    return INSTANCES[class_id]
+
+def env_of(value):
+    if type(value) != lattice.Type:
+        return None
+    if value.kind == 'instance':
+        return instance_env(value.payload[:-len('[instance]')])
+    if value.kind == 'class':
+        return CLASSES.get(value.payload)
+    if value.kind == 'module':
+        return MODULES.get(value.payload)
+    return None
+
+def call_function(f, args):
+    if len(args) != len(f.args):
+        return None
+
+    for name, cast, value in zip(f.args, f.casts, args):
+        if cast == 'ref:':
+            value = Ref(value)
+        elif cast == 'str:' and not (type(value) == lattice.Type and value.kind == 'str'):
+            value = lattice.STR
+        record(f.scope_id, name, value)
+
+    if f.analyzed != PASS:
+        f.analyzed = PASS
+        block(f.phrases, f.i, Env(f.scope_id, f.env, f.names))
+        if not f.is_generator and not f.returns:
+            record(f.scope_id, '', lattice.VOID)
+
+    if f.is_generator:
+        return lattice.named('generator', f.scope_id)
+    return shape(interpreter.LIB.types.get(f.scope_id, {}).get(''))
+
+def call(callee, args):
+    if type(callee) == Opaque:
+        return callee.call(args)
+    if type(callee) != lattice.Type:
+        return None
+
+    if callee.kind == 'f' and callee.payload in FUNCTIONS:
+        return call_function(FUNCTIONS[callee.payload], args)
+    if callee.kind == 'class':
+        instance = lattice.named('instance', callee.payload + '[instance]')
+        env = instance_env(callee.payload)
+        init = env.find('__init__') if env is not None else None
+        if type(init) == lattice.Type and init.kind == 'f' and init.payload in FUNCTIONS:
+            call_function(FUNCTIONS[init.payload], (instance,) + tuple(args))
+        return instance
+    if callee.kind == 'interface':
+        if len(args) == 1 and type(args[0]) == lattice.Type and args[0].kind == 'instance':
+            interpreter.LIB.add_implementation(callee.payload, args[0].payload)
+            return args[0]
+    return None
+
+def returns(value):
+    return lambda receiver, args: value
+
+def same(receiver, args):
+    return receiver
+
+def append(receiver, args):
+    if len(args) == 1:
+        record_item('list_items:' + receiver.payload, args[0])
+    return lattice.VOID
+
+def pop(receiver, args):
+    return element(receiver)
+
+def items(receiver, args):
+    return Opaque('items', receiver, element=(item('dict_keys:' + receiver.payload),
+                                              item('dict_values:' + receiver.payload)))
+
+CONTAINS = Opaque('contains', method=returns(lattice.BOOL))
+
+METHODS = {'str': {'lower': same, 'isdigit': returns(lattice.BOOL), 'isspace': returns(lattice.BOOL),
+                   'startswith': returns(lattice.BOOL), 'contains': returns(lattice.BOOL)},
+           'list': {'append': append, 'pop': pop, 'contains': returns(lattice.BOOL)},
+           'dict': {'items': items, 'contains': returns(lattice.BOOL)},
+           'set': {'contains': returns(lattice.BOOL)}}
+
+def member(owner, name):
+    if type(owner) == Opaque:
+        if name == 'contains':
+            return CONTAINS
+        return None
+
+    env = env_of(owner)
+    if env is not None:
+        return env.find(name)
+    if type(owner) == lattice.Type and owner.kind == 'module' and owner.payload in SYSTEM:
+        return SYSTEM[owner.payload].get(name)
+
+    if type(owner) != lattice.Type:
+        return None
+    if owner.kind == 'dict' and name == 'values':
+        return Opaque('values', owner, element=item('dict_values:' + owner.payload))
+    method = METHODS.get(owner.kind, {}).get(name)
+    if method is None:
+        return None
+    return Opaque(name, owner, method)
+
+BUILTINS = {'len': Opaque('len', method=returns(lattice.DOUBLE)),
+            'range': Opaque('range', method=returns(lattice.RANGE)),
+            'print': Opaque('print', method=returns(lattice.VOID)),
+            'str': Opaque('str', method=returns(lattice.STR)),
+            'ord': Opaque('ord', method=returns(lattice.DOUBLE)),
+            'chr': Opaque('chr', method=returns(lattice.STR)),
+            'sys': lattice.named('module', 'sys'),
+            '__name__': lattice.STR,
+            '__main__': lattice.STR}
+
+SYSTEM = {'sys': {'stdin': lattice.named('module', 'stdin')},
+          'stdin': {'read': Opaque('read', method=returns(lattice.STR)),
+                    'readline': Opaque('readline', method=returns(lattice.STR))}}
+
+def numeric(value):
+    return value is lattice.DOUBLE or value is lattice.BOOL
+
+def is_str(value):
+    return type(value) == lattice.Type and value.kind == 'str'
+
+def binary(op, left, right):
+    if op in parse.COMPARISONS or op == 'is in' or op == 'is not in':
+        return lattice.BOOL
+    if op == 'and' or op == 'or':
+        try:
+            return join(left, right)
+        except interpreter.CouldNotMergeTypes:
+            return right
+    if op == '+' and is_str(left) and is_str(right):
+        return lattice.STR
+    if numeric(left) and numeric(right):
+        return lattice.DOUBLE
+    return None
+
+def evaluate(tree, env):
+    return EVALUATE.get(tree.name, evaluate_unknown)(tree, env)
+
+def evaluate_unknown(tree, env):
+    return None
+
+def evaluate_binary(tree, env):
+    return binary(tree.inner[1].content, evaluate(tree.inner[0], env), evaluate(tree.inner[2], env))
+
+def evaluate_assignment(tree, env):
+    ltree = tree.inner[0]
+    sign = tree.inner[1].content
+    value = evaluate(tree.inner[2], env)
+
+    if sign in interpreter.INPLACE:
+        value = binary(sign[:-1], evaluate(ltree, env), value)
+    elif sign != '=':
+        return None
+
+    assign(ltree, value, env)
+    if ltree.name == 'name':
+        return env.find(ltree.content)
+    return None
+
+def evaluate_name(tree, env):
+    return env.find(tree.content)
+
+def evaluate_digit(tree, env):
+    return lattice.DOUBLE
+
+def evaluate_string(tree, env):
+    if len(interpreter.escape(tree.content[1:-1])) == 1:
+        return lattice.CHAR
+    return lattice.STR
+
+def evaluate_attr(tree, env):
+    if tree.inner[2].name != 'name':
+        return None
+    return member(evaluate(tree.inner[0], env), tree.inner[2].content)
+
+def arguments(tree, env):
+    if len(tree.inner) == 0:
+        return ()
+    if tree.inner[0].name == 'list':
+        return tuple([evaluate(arg, env) for arg in tree.inner[0].inner])
+    return (evaluate(tree.inner[0], env),)
+
+def evaluate_call(tree, env):
+    args = arguments(tree.inner[1], env)
+    callee = tree.inner[0]
+
+    if callee.name == 'attr' and callee.inner[-1].name == 'name':
+        owner = evaluate(callee.inner[0], env)
+        f = member(owner, callee.inner[-1].content)
+        if type(owner) == lattice.Type and owner.kind == 'instance' and type(f) == lattice.Type and f.kind == 'f':
+            return call(f, (owner,) + args)
+        return call(f, args)
+
+    return call(evaluate(callee, env), args)
+
+def evaluate_index(tree, env):
+    container = evaluate(tree.inner[0], env)
+    i = evaluate(tree.inner[1].inner[0], env)
+
+    if type(container) == tuple:
+        if tree.inner[1].inner[0].name == 'digit':
+            k = int(float(tree.inner[1].inner[0].content))
+            if 0 <= k < len(container):
+                return container[k]
+        return element(container)
+    if type(container) != lattice.Type:
+        return None
+
+    if container.kind == 'str':
+        if type(i) == Opaque:
+            return lattice.STR
+        return lattice.CHAR
+    if container.kind == 'dict':
+        return item('dict_values:' + container.payload)
+    return element(container)
+
+def evaluate_list(tree, env):
+    return tuple([evaluate(v, env) for v in tree.inner])
+
+def evaluate_parens(tree, env):
+    if len(tree.inner) == 0:
+        return ()
+    if len(tree.inner) == 1:
+        return evaluate(tree.inner[0], env)
+    return None
+
+def evaluate_brackets(tree, env):
+    if len(tree.inner) == 0:
+        return lattice.named('list', tree.phrase_id)
+    if len(tree.inner) == 1:
+        return evaluate(tree.inner[0], env)
+
+    # the variables take the container's element type, as the concrete engine
+    # binds them to each element in a frame of their own
+    expr, variables, container, cond = interpreter.comprehension_parts(tree)
+    names = {}
+    interpreter.bind_targets(variables, names)
+    inner = Env(interpreter.comprehension_id(tree), env, names)
+
+    assign(variables, element(evaluate(container, env)), inner)
+    if cond is not None:
+        evaluate(cond, inner)
+    record_item('list_items:' + tree.phrase_id, evaluate(expr, inner))
+    return lattice.named('list', tree.phrase_id)
+
+def evaluate_braces(tree, env):
+    if len(tree.inner) == 0:
+        return lattice.named('dict', tree.phrase_id)
+    if len(tree.inner) > 1:
+        return None
+
+    if tree.inner[0].name == 'list':
+        entries = tree.inner[0].inner
+    else:
+        entries = [tree.inner[0]]
+
+    if entries[0].name == 'range':
+        for entry in entries:
+            key, value, _ = interpreter.expand_range(entry)
+            if key is not None and value is not None:
+                record_item('dict_keys:' + tree.phrase_id, evaluate(key, env))
+                record_item('dict_values:' + tree.phrase_id, evaluate(value, env))
+        return lattice.named('dict', tree.phrase_id)
+
+    for entry in entries:
+        record_item('set_elements:' + tree.phrase_id, evaluate(entry, env))
+    return lattice.named('set', tree.phrase_id)
+
+def evaluate_range(tree, env):
+    for bound in interpreter.expand_range(tree):
+        if bound is not None:
+            evaluate(bound, env)
+    return Opaque('slice')
+
+def evaluate_keyword(tree, env):
+    if tree.content == 'None':
+        return lattice.VOID
+    if tree.content in ('True', 'False'):
+        return lattice.BOOL
+    return None
+
+def evaluate_unary(tree, env):
+    operand = evaluate(tree.inner[1], env)
+    if tree.inner[0].content == 'not':
+        return lattice.BOOL
+    if numeric(operand):
+        return lattice.DOUBLE
+    return None
+
+EVALUATE = {'binary': evaluate_binary, 'compare': evaluate_binary, 'assignment': evaluate_assignment,
+            'name': evaluate_name, 'digit': evaluate_digit, 'string': evaluate_string,
+            'attr': evaluate_attr, 'call': evaluate_call, 'index': evaluate_index,
+            'list': evaluate_list, '()': evaluate_parens, '[]': evaluate_brackets, '{}': evaluate_braces,
+            'range': evaluate_range, 'keyword': evaluate_keyword, 'unary': evaluate_unary}
+
+def assign(ltree, value, env):
+    if ltree.name in ('list', '()', '[]'):
+        if type(value) == tuple and len(value) == len(ltree.inner):
+            values = value
+        else:
+            values = [element(value)] * len(ltree.inner)
+        for lvalue, v in zip(ltree.inner, values):
+            assign(lvalue, v, env)
+    elif ltree.name == 'name':
+        record(env.scope_id, ltree.content, value)
+    elif ltree.name == 'index':
+        container = evaluate(ltree.inner[0], env)
+        key = evaluate(ltree.inner[1].inner[0], env)
+        if type(container) == lattice.Type and container.kind == 'list':
+            record_item('list_items:' + container.payload, value)
+        elif type(container) == lattice.Type and container.kind == 'dict':
+            record_item('dict_keys:' + container.payload, key)
+            record_item('dict_values:' + container.payload, value)
+    elif ltree.name == 'attr':
+        owner = env_of(evaluate(ltree.inner[0], env))
+        if owner is not None:
+            assign(ltree.inner[2], value, owner)
+
+def loop(body):
+    for _ in range(LOOPS):
+        before = progress()
+        body()
+        if progress() == before:
+            return
+
+def statement_unit(s, phrases, k, env):
+    tree = s.tree
+    args = interpreter.get_args(tree.inner[1])
+    f = FUNCTIONS.get(tree.phrase_id)
+    if f is None:
+        f = FUNCTIONS[tree.phrase_id] = Function(phrases, k + 1, args, env)
+
+    interpreter.LIB.func_args[f.scope_id] = tuple(f.args)
+    interpreter.LIB.args_cast[f.scope_id] = tuple(f.casts)
+    if f.is_generator:
+        interpreter.LIB.generators.add(f.scope_id)
+
+    record(env.scope_id, tree.inner[0].content, lattice.named('f', f.scope_id))
+
+    # a function whose arguments are all declared is analyzed even if never called
+    if f.args and all(cast == 'str:' for cast in f.casts):
+        call_function(f, [lattice.STR] * len(f.args))
+    elif not f.args:
+        call_function(f, [])
+
+def statement_class(s, phrases, k, env):
+    scope_id = s.tree.phrase_id
+    if s.tree.name == 'call':
+        arguments(s.tree.inner[1], env)
+
+    interpreter.LIB.add_scope(scope_id)
+    interpreter.LIB.add_scope(scope_id + '[instance]')
+
+    names = {}
+    for phrase in interpreter.block_phrases(phrases, k + 1, s.end):
+        interpreter.bind_phrase(phrase, names)
+    if scope_id not in CLASSES:
+        CLASSES[scope_id] = Env(scope_id, env, names)
+
+    record(env.scope_id, interpreter.header_name(s.tree), lattice.named('class', scope_id))
+    block(phrases, k + 1, CLASSES[scope_id])
+
+def statement_interface(s, phrases, k, env):
+    scope_id = s.tree.phrase_id
+    interpreter.LIB.add_interface(scope_id)
+    record(env.scope_id, s.tree.content, lattice.named('interface', scope_id))
+    block(phrases, k + 1, Env(scope_id, env, {}))
+
+def statement_interface_unit(s, phrases, k, env):
+    args = interpreter.get_args(s.tree.inner[1])
+    scope_id = s.tree.phrase_id
+
+    interpreter.LIB.func_args[scope_id] = tuple(args)
+    interpreter.LIB.args_cast[scope_id] = tuple([a[0] + ':' if a[0] else None for a in args])
+    record(env.scope_id, s.tree.inner[0].content, lattice.named('*f', scope_id))
+
+def statement_import(s, phrases, k, env):
+    record(env.scope_id, s.tree.content, lattice.named('module', s.tree.content))
+
+def statement_import_from(s, phrases, k, env):
+    record(env.scope_id, s.questions[0], lattice.named('module', s.questions[1] + '.' + s.questions[0]))
+
+def statement_return(s, phrases, k, env):
+    value = evaluate(s.tree, env) if s.tree is not None else lattice.VOID
+    record(env.scope_id, '', value)
+
+def statement_yield_from(s, phrases, k, env):
+    record(env.scope_id, '', element(evaluate(s.tree, env)))
+
+def statement_expr(s, phrases, k, env):
+    if s.tree is not None:
+        evaluate(s.tree, env)
+
+def statement_pass(s, phrases, k, env):
+    pass
+
+def statement_assert(s, phrases, k, env):
+    if s.tree.name == 'list':
+        for tree in s.tree.inner:
+            evaluate(tree, env)
+    else:
+        evaluate(s.tree, env)
+
+def statement_for(s, phrases, k, env):
+    value = evaluate(s.tree.inner[2], env)
+    record(env.scope_id, interpreter.anonymous(s.tree.inner[2].origin.index), value)
+
+    def body():
+        assign(s.tree.inner[0], element(value), env)
+        block(phrases, k + 1, env)
+    loop(body)
+
+def statement_while(s, phrases, k, env):
+    def body():
+        evaluate(s.tree, env)
+        block(phrases, k + 1, env)
+    loop(body)
+
+def statement_if(s, phrases, k, env):
+    evaluate(s.tree, env)
+    block(phrases, k + 1, env)
+
+def statement_else(s, phrases, k, env):
+    block(phrases, k + 1, env)
+
+def statement_cast(s, phrases, k, env):
+    if s.tree.name == 'list':
+        names = [name.content for name in s.tree.inner]
+    else:
+        names = [s.tree.content]
+
+    saved = dict(env.casts)
+    for name in names:
+        ptr = env.find(name)
+        value = ptr.v if type(ptr) == Ref else None
+        record(env.scope_id, f'(cast)({s.tree.phrase_id})' + name, value)
+        env.casts[name] = value
+
+    block(phrases, k + 1, env)
+    env.casts = saved
+
+STATEMENTS = {'unit': statement_unit, 'class': statement_class, 'interface': statement_interface,
+              'interface-unit': statement_interface_unit, 'import': statement_import,
+              'import ? from ?': statement_import_from, 'return': statement_return,
+              'yield': statement_return, 'yield from': statement_yield_from,
+              'raise': statement_expr, 'break': statement_pass,
+              'continue': statement_pass, 'pass': statement_pass, 'assert': statement_assert,
+              'expr': statement_expr, 'for': statement_for, 'while': statement_while,
+              'if': statement_if, 'elif': statement_if, 'else': statement_else, 'cast': statement_cast,
+              'try': statement_else, 'except': statement_else, 'with': statement_if}
+
+def block(phrases, i, env):
+    k = i
+    while 0 <= k < len(phrases):
+        s = phrases[k]
+        STATEMENTS[s.name](s, phrases, k, env)
+        k = s.next
+
+def add_sys(inp):
+    pass
+
+def load_module(name, phrases, silent=True):
+    global PASS
+
+    if name in MODULES:
+        return
+
+    names = {}
+    for phrase in interpreter.block_phrases(phrases, 0, len(phrases) - 1):
+        interpreter.bind_phrase(phrase, names)
+    env = MODULES[name] = Env(name, None, names)
+
+    for phrase in phrases:
+        if phrase.name == 'import':
+            yield interpreter.ImportRequest(phrase.tree.content)
+        elif phrase.name == 'import ? from ?':
+            yield interpreter.ImportRequest(phrase.questions[1] + '.' + phrase.questions[0], name=phrase.questions[0])
+
+    for _ in range(PASSES):
+        PASS += 1
+        before = progress()
+        block(phrases, 0, env)
+        if progress() == before:
+            break
+
+def reset():
+    interpreter.reset()
+    for table in (FUNCTIONS, CLASSES, INSTANCES, MODULES, REFS, CHANGES):
+        table.clear()
@@ -4,10 +4,19 @@ class BuiltinInstance:
 class Types:
     types = {}
     typeof = None
+    skipped = 0
+    merged = 0
+    version = 0
+
+    def reset():
+        Types.types = {}
+        Types.skipped = Types.merged = Types.version = 0
 
     def update(name, tp):
+        Types.merged += 1
         if name not in Types.types:
             Types.types[name] = tp
+            Types.version += 1
         else:
             assert Types.types[name] == tp
 
@@ -22,15 +31,16 @@ class Function:
     def is_method(self):
         return self.method
 
+# values share their method tables through the class; scope is the value itself
+
 class Set:
+    __slots__ = ('v', 'phrase_id')
+    is_instance = True
+
     def __init__(self, v, phrase_id):
-        self.is_instance = True
-        self.scope = self
         self.v = set(v)
         self.phrase_id = phrase_id
 
-        self.vars = {'contains': Function(Set.contains, True)}
-
         if self.v:
             v = list(self.v)[0]
             Types.update('set_elements:' + phrase_id, Types.typeof(v))
@@ -60,16 +70,26 @@ class Set:
     def __eq__(self, other):
         return self.v == other.v
 
+    @property
+    def scope(self):
+        return self
+
     def contains(self, c):
         return c in self.v
 
+    vars = {'contains': Function(contains, True)}
+
 class DictValues:
+    __slots__ = ('d',)
+    is_instance = True
+
     def __init__(self, d):
-        self.is_instance = True
-        self.scope = self
-        self.vars = {'contains': Function(DictValues.contains, True)}
         self.d = d
 
+    @property
+    def scope(self):
+        return self
+
     def find(self, name):
         if name in self.vars:
             return self.vars[name]
@@ -83,14 +103,13 @@ class DictValues:
     def contains(self, value):
         return value in self.d.v.values()
 
+    vars = {'contains': Function(contains, True)}
+
 class Dict:
-    def __init__(self, v, phrase_id):
-        self.is_instance = True
-        self.scope = self
+    __slots__ = ('v', 'phrase_id')
+    is_instance = True
 
-        self.vars = {'values': DictValues(self),
-                     'items': Function(Dict.items, True),
-                     'contains': Function(Dict.contains, True)}
+    def __init__(self, v, phrase_id):
         self.v = dict(v)
         self.phrase_id = phrase_id
 
@@ -103,15 +122,21 @@ class Dict:
         return self.v.items()
 
     def find(self, name):
+        if name == 'values':
+            return DictValues(self)
         if name in self.vars:
             return self.vars[name]
         assert False, name
 
     def can_find(self, name):
-        if name in self.vars:
+        if name == 'values' or name in self.vars:
             return True
         return False
 
+    @property
+    def scope(self):
+        return self
+
     def __repr__(self):
         return repr(self.v)
 
@@ -133,15 +158,17 @@ class Dict:
     def contains(self, c):
         return c in self.v
 
+    vars = {'items': Function(items, True),
+            'contains': Function(contains, True)}
+
 class List:
+    __slots__ = ('v', 'phrase_id', 'item_type')
+    is_instance = True
+
     def __init__(self, v, phrase_id):
-        self.is_instance = True
-        self.scope = self
-        self.vars = {'append': Function(List.append, True),
-                     'pop': Function(List.pop, True),
-                     'contains': Function(List.contains, True)}
         self.v = list(v)
         self.phrase_id = phrase_id
+        self.item_type = None
 
         if self.v:
             if phrase_id.startswith('dict_values:'):
@@ -152,12 +179,21 @@ class List:
         return str(self.serial_number)
 
     def append(self, v):
-        Types.update('list_items:' + self.phrase_id, Types.typeof(v))
+        tp = Types.typeof(v)
+        if tp is self.item_type:
+            Types.skipped += 1
+        else:
+            Types.update('list_items:' + self.phrase_id, tp)
+            self.item_type = tp
         self.v.append(v)
 
     def pop(self):
         return self.v.pop()
 
+    @property
+    def scope(self):
+        return self
+
     def find(self, name):
         if name in self.vars:
             return self.vars[name]
@@ -193,15 +229,15 @@ class List:
     def contains(self, c):
         return c in self.v
 
+    vars = {'append': Function(append, True),
+            'pop': Function(pop, True),
+            'contains': Function(contains, True)}
+
 class String:
+    __slots__ = ('v',)
+    is_instance = True
+
     def __init__(self, v):
-        self.is_instance = True
-        self.scope = self
-        self.vars = {'lower': Function(String.lower, True),
-                     'isdigit': Function(String.is_digit, True),
-                     'contains': Function(String.contains, True),
-                     'isspace': Function(String.is_space, True),
-                     'startswith': Function(String.startswith, True)}
         if type(v) == String:
             self.v = v.v
         else:
@@ -218,6 +254,10 @@ class String:
             return True
         return False
 
+    @property
+    def scope(self):
+        return self
+
     def startswith(self, s):
         return self.v.startswith(s.v)
 
@@ -259,7 +299,9 @@ class String:
 
     def at(self, i):
         if type(i) == float and i.is_integer():
-            return String(self.v[int(i)])
+            c = self.v[int(i)]
+            s = CHARS.get(c)
+            return String(c) if s is None else s
         else:
             r = i.expand(len(self.v))
             return String(self.v[r[0]:r[1]:r[2]])
@@ -267,51 +309,77 @@ class String:
     def contains(self, c):
         return c.v in self.v
 
+    vars = {'lower': Function(lower, True),
+            'isdigit': Function(is_digit, True),
+            'contains': Function(contains, True),
+            'isspace': Function(is_space, True),
+            'startswith': Function(startswith, True)}
+
+# strings never change, so indexing shares one value per single byte character
+CHARS = {chr(i): String(chr(i)) for i in range(256)}
+
+class Input:
+    # sys.stdin over a memory-mapped file, an open file or bytes; bytes map
+    # one to one to characters, as the C runtime reads them
+    def __init__(self, source):
+        self.source = source
+
+    def read(self, n=None):
+        if n is None:
+            data = self.source.read()
+        else:
+            data = self.source.read(max(int(n), 0))
+        return String(data.decode('latin-1'))
+
+    def readline(self):
+        return String(self.source.readline().decode('latin-1'))
+
 class Range:
-    def __init__(self, v):
-        self.is_instance = True
-        self.scope = self
-        self.v = v
-        self.i = 0
+    # an arithmetic sequence over python's range; items are made as they are read
+    __slots__ = ('r',)
+    is_instance = True
+
+    def __init__(self, r):
+        self.r = r
+
+    @property
+    def scope(self):
+        return self
+
+    @property
+    def v(self):
+        return [float(i) for i in self.r]
 
     def __repr__(self):
-        return repr(self.v)
+        return repr(self.r)
 
     def __str__(self):
-        return self.v
+        return str(self.r)
 
     def __len__(self):
-        return len(self.v)
+        return len(self.r)
 
     def __hash__(self):
-        return hash(self.v)
+        return hash(self.r)
 
     def __eq__(self, other):
-        return self.v == other.v
+        return self.r == other.r
 
     def __add__(self, other):
         return List(self.v + other.v)
 
     def at(self, i):
         assert i.is_integer()
-        return self.v[int(i)]
+        return float(self.r[int(i)])
 
     def __iter__(self):
-        return self
-
-    def __next__(self):
-        if self.i == len(self.v):
-            raise StopIteration()
-        v = self.v[self.i]
-        self.i += 1
-        return v
+        return map(float, self.r)
 
     def contains(self, c):
-        return c in self.v
+        return type(c) == float and c.is_integer() and int(c) in self.r
 
 def _range(*args):
-    iargs = [int(a) for a in args]
-    return Range([float(i) for i in range(*iargs)])
+    return Range(range(*[int(a) for a in args]))
 
 PRINT = Function(print, False)
 LEN = Function(len, False)
@@ -3,6 +3,8 @@ import expressions
 import definer
 import builtin
 import loader
+import abstract
+import json
 
 from definer import w, scope_id_to_name
 from expressions import Scope, Strings, Arguments, Expr
@@ -80,6 +82,68 @@ class Temps:
     def absorb(expr):
         return Temps.temps[-1].vars.absorb(expr)
 
+class Profile:
+    # execution counts from loader --profile, by phrase; empty when compiling without one
+    phrases = {}
+    calls = {}
+    hottest = 0
+
+    # a branch needs this many tests, and this share of one outcome, to get a hint
+    MIN_TESTS = 16
+    LIKELY = 0.9
+    # a function called at least this share of the hottest one's calls is hot
+    HOT = 0.1
+
+    def load(path, base, extension, modules):
+        with open(path) as f:
+            counts = json.load(f)
+
+        for name, phrases in modules.items():
+            _, filename = loader.module_path(base, name, extension)
+            if name not in counts or counts[name]['key'] != loader.file_key(name, filename):
+                continue
+
+            for i, n in counts[name]['phrases'].items():
+                Profile.phrases[phrases[int(i)]] = n
+            for i, n in counts[name]['calls'].items():
+                Profile.calls[phrases[int(i)]] = n
+            for phrase in phrases:
+                if phrase.name == 'unit':
+                    Profile.calls.setdefault(phrase, 0)
+
+        Profile.hottest = max(Profile.calls.values(), default=0)
+
+    def expect(phrases, j, cond, loop=False):
+        if phrases[j] not in Profile.phrases:
+            return cond
+
+        taken = Profile.phrases.get(phrases[j + 1], 0)
+        tests = Profile.phrases[phrases[j]]
+        # a loop tests its condition once more than it runs its body, each time it is entered
+        if loop:
+            tests += taken
+
+        if tests < Profile.MIN_TESTS:
+            return cond
+        if taken >= tests * Profile.LIKELY:
+            return '__builtin_expect(!!(' + cond + '), 1)'
+        if taken <= tests * (1 - Profile.LIKELY):
+            return '__builtin_expect(!!(' + cond + '), 0)'
+        return cond
+
+    def attribute(phrase):
+        if phrase not in Profile.calls:
+            return ''
+        if Profile.calls[phrase] == 0:
+            return '__attribute__((cold)) '
+        if Profile.calls[phrase] >= Profile.hottest * Profile.HOT:
+            return '__attribute__((hot)) '
+        return ''
+
+    def order(ranges, phrases):
+        # hottest functions first; the rest keep their order
+        return sorted(ranges, key=lambda r: -Profile.calls.get(phrases[r[0]], 0))
+
 class State:
     def __init__(self, scope, n_tabs):
         self.scope = scope
@@ -131,17 +195,8 @@ def args_from_tree(tree, state):
     vals = expressions.argvalues(tree, state.scope, Temps.temps[-1].vars)
     return arguments(*vals)
 
-def skip_segment(phrases, i, level):
-    if i == len(phrases):
-        return i
-
-    level = phrases[i].level
-    i += 1
-    while i < len(phrases) and phrases[i].level > level:
-        i += 1
-    if i == len(phrases):
-        return i
-    return i - 1
+def skip_segment(phrases, i):
+    return phrases[i].end
 
 def is_tp_ref(tp):
     proto, _ = tp.split(':', maxsplit=1)
@@ -305,7 +360,7 @@ def func(phrases, j, state):
     asep = ', ' if args else ''
     astr = 'struct thread *thread' + asep + ', '.join(alst)
 
-    state.print(ret, ' f_', scope_name, '(', astr, ')')
+    state.print(Profile.attribute(s), ret, ' f_', scope_name, '(', astr, ')')
     state.print('{')
 
     inner = State(scope, state.n_tabs)
@@ -409,31 +464,21 @@ def cond_with_temps(cond):
     else:
 	    return cond.final()
 
-def elses(phrases, j, level, state):
-    j += 1
-    while (j < len(phrases)):
+def elses(phrases, j, state):
+    while phrases[j].orelse >= 0:
+        j = phrases[j].orelse
         s = phrases[j]
 
-        if s.level < level:
-            return j - 1
-
+        state.print('// ', s.debug)
         if s.name == 'else':
-            state.print('// ', s.debug)
             state.print('else {')
-            j = segment(phrases, j + 1, state)
-            state.print('}')
-        elif s.name == 'elif':
-            state.print('// ', s.debug)
-            expr = val(s.tree, state)
-            state.print(f'else if ({cond_with_temps(expr)}) ', '{')
-            j = segment(phrases, j + 1, state)
-            state.print('}')
         else:
-            return j - 1
-
-        j += 1
+            expr = val(s.tree, state)
+            state.print(f'else if ({Profile.expect(phrases, j, cond_with_temps(expr))}) ', '{')
+        segment(phrases, j + 1, state)
+        state.print('}')
 
-    return j - 1
+    return phrases[j].end
 
 def segment(phrases, j, state):
     level = -1
@@ -453,7 +498,7 @@ def segment(phrases, j, state):
 
         if s.name == 'unit':
             #j = func(phrases, j, level, state)
-            j = skip_segment(phrases, j, state)
+            j = skip_segment(phrases, j)
             continue
 
         if s.name == 'class':
@@ -461,7 +506,7 @@ def segment(phrases, j, state):
             _id = s.tree.phrase_id
             name = scope_id_to_name(_id)
             state.print('static_init_', name, '(thread);')
-            j = skip_segment(phrases, j, state)
+            j = skip_segment(phrases, j)
             continue
 
         if s.name == 'import':
@@ -550,7 +595,7 @@ def segment(phrases, j, state):
             state.print('/* assert end */ }')
         elif s.name == 'for':
             i_name = s.tree.inner[0]
-            tp = interpreter.LIB.types[state.scope.scope_id][interpreter.anonymous(s.tree.phrase_id)]
+            tp = interpreter.LIB.types[state.scope.scope_id][interpreter.anonymous(s.tree.origin.index)]
 
             state.print('/* begin loop */ {')
             Temps.push(state)
@@ -559,7 +604,7 @@ def segment(phrases, j, state):
                 _id = tp[len('generator:'):]
                 gen = val(s.tree.inner[2], state)
                 ret = interpreter.LIB.types[_id]['']
-                name = 'it' if not state.scope.stateless else definer.anonymous(s.tree.phrase_id)
+                name = 'it' if not state.scope.stateless else definer.anonymous(s.tree.origin.index)
                 scope_name = scope_id_to_name(_id)
 
                 state.print('struct g_', scope_name, ' *', name, ' = ', gen.final(), ';')
@@ -607,7 +652,7 @@ def segment(phrases, j, state):
 
             Temps.push(state)
             expr = val(s.tree, state)
-            state.print(f'while ({cond_with_temps(expr)}) ', '{')
+            state.print(f'while ({Profile.expect(phrases, j, cond_with_temps(expr), True)}) ', '{')
 
             j = segment(phrases, j + 1, state)
             state.print('}')
@@ -619,10 +664,10 @@ def segment(phrases, j, state):
             Temps.push(state)
 
             expr = val(s.tree, state)
-            state.print(f'if ({cond_with_temps(expr)}) ', '{')
-            j = segment(phrases, j + 1, state)
+            state.print(f'if ({Profile.expect(phrases, j, cond_with_temps(expr))}) ', '{')
+            segment(phrases, j + 1, state)
             state.print('}')
-            j = elses(phrases, j, level, state)
+            j = elses(phrases, j, state)
 
             Temps.pop()
             state.print('/* end if block */ }')
@@ -779,7 +824,7 @@ def compile_ranges(name, ranges, phrases):
     state.shift(-1)
     state.print('} m_', name, ' = {0};')
 
-    for start, tp in ranges:
+    for start, tp in Profile.order(ranges, phrases):
         state.print('// ', phrases[start].debug)
 
         if tp == 'f':
@@ -835,9 +880,13 @@ def print_main(main, modules):
         print('    rt_str_free(&thread, __main__);', file=f)
         print('}', file=f)
 
-def compile(filename, extension, runtime, samples, main, header):
+def compile(filename, extension, runtime, samples, main, header, artifacts=True, profile=None):
     modules = {}
-    loader.loadabs(modules, filename, extension, samples)
+    loader.loadabs(modules, filename, extension, samples, artifacts)
+
+    if profile is not None:
+        base, _ = loader.splitname(filename, extension)
+        Profile.load(profile, base, extension, modules)
     
     with open(runtime) as f:
         print(f.read())
@@ -870,9 +919,17 @@ def main():
     parser.add_argument('--samples', default='samples.hut')
     parser.add_argument('--main', default=None)
     parser.add_argument('--header', default=None)
+    parser.add_argument('--converge', type=int, default=None)
+    parser.add_argument('--abstract', action='store_true')
+    parser.add_argument('--no-artifacts', dest='artifacts', action='store_false')
+    parser.add_argument('--profile', default=None)
     args = parser.parse_args()
 
-    compile(args.filename, args.extension, args.runtime, args.samples, args.main, args.header)
+    interpreter.CONVERGE = args.converge
+    if args.abstract:
+        loader.ENGINE = abstract
+
+    compile(args.filename, args.extension, args.runtime, args.samples, args.main, args.header, args.artifacts, args.profile)
 
 if __name__ == "__main__":
     main()
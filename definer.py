@@ -301,8 +301,8 @@ def block(ranges, phrases, i, pscope):
             pass
     return j
 
-def anonymous(scope_id):
-    name = interpreter.anonymous(scope_id)
+def anonymous(index):
+    name = interpreter.anonymous(index)
     return name.replace('@', 'anon_')
 
 def variable_type(tps):
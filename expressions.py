@@ -715,7 +715,8 @@ class BuiltinScope:
         elif attr == 'sys':
             self.names = {'stdin': 'builtin:stdin'}
         elif attr == 'stdin':
-            self.names = {'read': 'module_call:rt_read_input:str:'}
+            self.names = {'read': 'module_call:rt_read_input:str:',
+                          'readline': 'module_call:rt_read_line:str:'}
         elif attr == 'c:double':
             self.names = {'__str__': 'instance_call:rt_float_str:str:'}
         elif attr == 'c:bool':
@@ -1,7 +1,10 @@
 import sys
+import io
+import operator
 import scanner
 import tokenize
 import builtin
+import lattice
 
 DEBUG = False
 
@@ -33,61 +36,45 @@ class ImportRequest:
             self.name = name
 
 class Types:
-    def merge_types(t1, t2, depth):
-        if t1 == t2:
-            return t1
-
-        if t1.startswith('str:') and t2.startswith('str:'):
-            return 'str:'
-        if t1.startswith('tuple:') and t2.startswith('tuple:'):
-            sep = '&' + str(depth) + '&'
-            desc1 = t1[len('tuple:'):].split(sep)
-            desc2 = t2[len('tuple:'):].split(sep)
-            if len(desc1) != len(desc2):
-                return 'list:'
-            merged = [Types.merge_types(d1, d2, depth + 1) for d1, d2 in zip(desc1, desc2)]
-            return sep.join(merged)
-        if t1.startswith('tuple:') and t2.startswith('list:') or t2.startswith('tuple:') and t1.startswith('list:'):
-            return 'list:'
-        if t1.startswith('ref:') or t2.startswith('ref:'):
-            return 'ref:'
-
-        raise CouldNotMergeTypes(t1, t2)
+    def merge_types(t1, t2):
+        tp = lattice.merge(t1, t2)
+        if tp is None:
+            raise CouldNotMergeTypes(t1, t2)
+        return tp
 
     def typeof(value, depth=0):
         if type(value) == float:
-            return 'c:double'
+            return lattice.DOUBLE
         elif type(value) == bool:
-            return 'c:bool'
+            return lattice.BOOL
         elif type(value) == F:
-            return 'f:' + value.scope_id
+            return lattice.named('f', value.scope_id)
         elif type(value) == Instance:
-            return 'instance:' + value.scope.scope_id
+            return lattice.named('instance', value.scope.scope_id)
         elif type(value) == O:
-            return 'class:' + value.scope.scope_id
+            return lattice.named('class', value.scope.scope_id)
         elif type(value) == Iface:
-            return 'interface:' + value.scope.scope_id
+            return lattice.named('interface', value.scope.scope_id)
         elif type(value) == builtin.Set:
-            return 'set:' + value.phrase_id
+            return lattice.named('set', value.phrase_id)
         elif type(value) == builtin.Dict:
-            return 'dict:' + value.phrase_id
+            return lattice.named('dict', value.phrase_id)
         elif type(value) == builtin.List:
-            return 'list:' + value.phrase_id
+            return lattice.named('list', value.phrase_id)
         elif type(value) == builtin.String:
-            return 'str:' + ('1' if len(value.v) == 1 else '')
+            return lattice.CHAR if len(value.v) == 1 else lattice.STR
         elif value is None:
-            return 'c:void'
+            return lattice.VOID
         elif type(value) == tuple:
-            sep = '&' + str(depth) + '&'
-            return 'tuple:' + sep.join(Types.typeof(v, depth + 1) for v in value)
+            return lattice.tuple_of(tuple([Types.typeof(v, depth + 1) for v in value]), depth)
         elif type(value) == Generator:
-            return 'generator:' + value.f.scope_id
+            return lattice.named('generator', value.f.scope_id)
         elif type(value) == builtin.Range:
-            return 'constructor:range'
+            return lattice.RANGE
         elif type(value) == Module:
-            return 'module:' + value.scope.scope_id
+            return lattice.named('module', value.scope.scope_id)
         elif type(value) == VoidPointer:
-            return 'ref:'
+            return lattice.REF
         else:
             assert False, value.__class__.__name__
 
@@ -99,9 +86,18 @@ class Library:
         self.args_cast = {}
         self.interfaces = {}
 
+        # the last type recorded for each name, by scope
+        self.observed = {}
+        self.skipped = 0
+        self.merged = 0
+
+        # bumped whenever types gains or changes an entry
+        self.version = 0
+
     def add_scope(self, _id):
         if _id not in self.types:
             self.types[_id] = {}
+            self.version += 1
 
     def update_type(self, scope_id, name, tp):
         if scope_id not in self.types:
@@ -109,10 +105,50 @@ class Library:
         else:
             d = self.types[scope_id]
 
-        if name not in d:
+        old = d.get(name)
+        if old is None:
             d[name] = tp
+            self.version += 1
+        elif old is not tp:
+            tp = Types.merge_types(old, tp)
+            if tp is not old:
+                d[name] = tp
+                self.version += 1
+
+    # the type is replaced rather than merged in, so it can be made wider than
+    # any type the name was given
+    def replace_type(self, scope_id, name, tp):
+        d = self.types.setdefault(scope_id, {})
+        if d.get(name) is not tp:
+            d[name] = tp
+            self.version += 1
+
+    def same(self, other):
+        return (self.types == other.types and self.generators == other.generators and
+                self.func_args == other.func_args and self.args_cast == other.args_cast and
+                self.interfaces == other.interfaces)
+
+    def observations(self, scope_id):
+        seen = self.observed.get(scope_id)
+        if seen is None:
+            seen = self.observed[scope_id] = {}
+        return seen
+
+    # merging a type into a name twice changes nothing, so a repeat of the last
+    # type seen for the name is skipped
+    def observe(self, seen, scope_id, name, value):
+        tp = Types.typeof(value)
+        if seen.get(name) is tp:
+            self.skipped += 1
         else:
-            d[name] = Types.merge_types(d[name], tp, 0)
+            self.record(seen, scope_id, name, tp)
+
+    def record(self, seen, scope_id, name, tp):
+        seen[name] = tp
+        self.merged += 1
+        if COVERAGE:
+            OBSERVATIONS.add((scope_id, name, tp))
+        self.update_type(scope_id, name, tp)
 
     def add_interface(self, _id):
         if _id not in self.interfaces:
@@ -123,6 +159,51 @@ class Library:
 
 LIB = Library()
 
+# in convergence mode a loop stops after this many iterations in a row that
+# neither change a type nor run a phrase for the first time
+CONVERGE = None
+COVERED = set()
+
+# in coverage mode every phrase run and every type observation is recorded
+COVERAGE = False
+OBSERVATIONS = set()
+
+# in profiling mode every phrase run and every function call is counted, by phrase
+PROFILE = False
+PHRASE_COUNTS = {}
+CALL_COUNTS = {}
+
+def progress():
+    return LIB.version + builtin.Types.version + len(COVERED)
+
+class Watch:
+    def __init__(self):
+        self.seen = progress()
+        self.quiet = 0
+
+    def converged(self):
+        now = progress()
+        if now == self.seen:
+            self.quiet += 1
+        else:
+            self.seen = now
+            self.quiet = 0
+        return self.quiet >= CONVERGE
+
+def reset():
+    global LIB
+    LIB = Library()
+    Scope.MODULES = {}
+    Instance.constructors = set()
+    COVERED.clear()
+    OBSERVATIONS.clear()
+    PHRASE_COUNTS.clear()
+    CALL_COUNTS.clear()
+    builtin.Types.reset()
+
+NO_CASTS = frozenset()
+UNSET = object()
+
 class Scope:
     MODULES = {}
 
@@ -130,27 +211,34 @@ class Scope:
         self.parent = parent
         self.vars = {}
 
-        self.casts = set()
-        self.casts_stack = []
+        self.casts = NO_CASTS
+        self.casts_stack = ()
 
         self.is_instance = is_instance
         self.scope_id = scope_id
+        self.seen = LIB.observations(scope_id)
 
-    def update(self, name, value):
+    def update(self, name, value, tp=None):
         self.vars[name] = value
-        LIB.update_type(self.scope_id, name, Types.typeof(value))
+        if tp is None:
+            tp = Types.typeof(value)
+        if self.seen.get(name) is tp:
+            LIB.skipped += 1
+        else:
+            LIB.record(self.seen, self.scope_id, name, tp)
     
     def cast(self, phrase_id, names):
         for name in names:
             ptr = self.find(name)
             value = ptr.v
-            LIB.update_type(self.scope_id, f'(cast)({phrase_id})' + name, Types.typeof(value))
+            LIB.observe(self.seen, self.scope_id, f'(cast)({phrase_id})' + name, value)
 
-        self.casts_stack.append(self.casts.copy())
-        self.casts.update(names)
+        self.casts_stack = self.casts_stack + (self.casts,)
+        self.casts = self.casts | frozenset(names)
 
     def cast_pop(self):
-        self.casts = self.casts_stack.pop()
+        self.casts = self.casts_stack[-1]
+        self.casts_stack = self.casts_stack[:-1]
 
     def find(self, name):
         if name in self.vars:
@@ -168,6 +256,69 @@ class Scope:
         except MissingName:
             return False
 
+# module, class, function and comprehension names live in a fixed list of
+# slots, laid out once per block; names missing from the layout still go to vars
+class Frame:
+    __slots__ = ('parent', 'layout', 'slots', 'vars', 'casts', 'casts_stack', 'is_instance', 'scope_id', 'seen')
+
+    def __init__(self, parent, layout, scope_id):
+        self.parent = parent
+        self.layout = layout
+        self.slots = [UNSET] * len(layout)
+        self.vars = None
+
+        self.casts = NO_CASTS
+        self.casts_stack = ()
+
+        self.is_instance = False
+        self.scope_id = scope_id
+        self.seen = LIB.observations(scope_id)
+
+    def update(self, name, value, tp=None):
+        slot = self.layout.get(name)
+        if slot is not None:
+            self.slots[slot] = value
+        else:
+            if self.vars is None:
+                self.vars = {}
+            self.vars[name] = value
+        if tp is None:
+            tp = Types.typeof(value)
+        if self.seen.get(name) is tp:
+            LIB.skipped += 1
+        else:
+            LIB.record(self.seen, self.scope_id, name, tp)
+
+    def bind(self, name, value):
+        slot = self.layout.get(name)
+        if slot is not None:
+            self.slots[slot] = value
+        else:
+            if self.vars is None:
+                self.vars = {}
+            self.vars[name] = value
+
+    cast = Scope.cast
+    cast_pop = Scope.cast_pop
+    can_find = Scope.can_find
+
+    def find(self, name):
+        slot = self.layout.get(name)
+        if slot is not None:
+            value = self.slots[slot]
+        elif self.vars is not None:
+            value = self.vars.get(name, UNSET)
+        else:
+            value = UNSET
+
+        if value is not UNSET:
+            if name in self.casts:
+                return value.v
+            return value
+        if self.parent:
+            return self.parent.find(name)
+        raise MissingName(name)
+
 class Generator:
     def __init__(self, f, scope):
         self.f = f
@@ -185,11 +336,12 @@ class F:
     arg_types = {}
     generators = set()
 
-    def __init__(self, phrases, i, args, parent, is_generator):
+    def __init__(self, phrases, i, args, parent, is_generator, layout):
         self.parent = parent
         self.phrases = phrases
         self.i = i
         self.args = [a[1] for a in args]
+        self.layout = layout
         self.is_generator = is_generator
         self.scope_id = phrases[i - 1].tree.phrase_id
         
@@ -217,7 +369,11 @@ class F:
             else:
                 assert False, tp
 
-        scope = Scope(self.parent, False, self.scope_id)
+        if PROFILE:
+            unit = self.phrases[self.i - 1]
+            CALL_COUNTS[unit] = CALL_COUNTS.get(unit, 0) + 1
+
+        scope = Frame(self.parent, self.layout, self.scope_id)
         for name, value in zip(self.args, args):
             scope.update(name, value)
 
@@ -227,7 +383,7 @@ class F:
         goto = synchronized_block(self.phrases, self.i, 0, scope)
         assert goto._return or goto._end
 
-        LIB.update_type(self.scope_id, '', Types.typeof(goto.v))
+        LIB.observe(scope.seen, self.scope_id, '', goto.v)
 
         return goto.v
 
@@ -248,7 +404,7 @@ class O:
         self.i = i
         self.base = base
         self.scope_id = phrases[i - 1].tree.phrase_id
-        self.scope = Scope(parent, False, self.scope_id)
+        self.scope = Frame(parent, frame_layout(phrases, i, phrases[i - 1].end, ()), self.scope_id)
 
         LIB.add_scope(self.scope_id)
         LIB.add_scope(self.scope_id + '[instance]')
@@ -267,7 +423,7 @@ class Iface:
         self.phrases = phrases
         self.i = i
         self.scope_id = phrases[i - 1].tree.phrase_id
-        self.scope = Scope(parent, False, self.scope_id)
+        self.scope = Frame(parent, frame_layout(phrases, i, phrases[i - 1].end, ()), self.scope_id)
 
         LIB.add_interface(self.scope_id)
 
@@ -318,38 +474,10 @@ class Module:
         self.scope = scope
 
 def skip_block(phrases, i, min_level):
-    level = -1
-    last = -1
-    for j in range(i, len(phrases)):
-        phrase = phrases[j]
-
-        if level < 0:
-            if phrase.level < min_level:
-                raise BadIndent(j)
-            last = j
-            level = phrase.level
-        elif phrase.level < level:
-            return last
-        else:
-            last = j
-
-    assert last >= 0
-    return last
-
-def yield_lookup(phrases, i, j):
-    k = i - 1
-    while k <= j:
-        k += 1
-        phrase = phrases[k]
-
-        if phrase.name == 'unit' or phrase.name == 'class':
-            k = skip_block(phrases, k + 1, 0)
-            continue            
-
-        if phrase.name.startswith('yield'):
-            return True
-
-    return False
+    assert i < len(phrases)
+    if phrases[i].level < min_level:
+        raise BadIndent(i)
+    return phrases[i - 1].end
 
 def get_arg(tree):
     if tree.name == 'name':
@@ -378,6 +506,149 @@ def get_args(root):
 
     return tuple(get_arg(tree) for tree in root.inner[0].inner)
 
+# a block's names by slot, and the layout of the block it is nested in
+class Layout(dict):
+    __slots__ = ('parent',)
+
+    def __init__(self, parent):
+        self.parent = parent
+
+# slot layouts by block header, the layout each body phrase runs in, the names
+# cast around it, and the layout of each comprehension and every tree inside it
+LAYOUTS = {}
+FRAME_OF = {}
+CASTS_OF = {}
+COMPREHENSIONS = {}
+
+def header_name(tree):
+    if tree.name == 'call':
+        return tree.inner[0].content
+    return tree.content
+
+def bind_targets(ltree, layout):
+    if ltree.name == 'name':
+        layout.setdefault(ltree.content, len(layout))
+    elif ltree.name in ('list', '()', '[]'):
+        for lvalue in ltree.inner:
+            bind_targets(lvalue, layout)
+
+def bind_assignments(tree, layout):
+    if type(tree) == tokenize.Token:
+        return
+    if tree.name == 'assignment':
+        bind_targets(tree.inner[0], layout)
+    for inner in tree.inner:
+        bind_assignments(inner, layout)
+
+# the phrases running directly in a block, with nested units, classes and
+# interfaces reduced to their headers
+def block_phrases(phrases, i, j):
+    k = i
+    while k <= j:
+        phrase = phrases[k]
+        yield phrase
+
+        if phrase.name in ('unit', 'class', 'interface'):
+            k = phrase.end + 1
+        else:
+            k += 1
+
+def bind_phrase(phrase, layout):
+    if phrase.name in ('unit', 'class', 'interface'):
+        layout.setdefault(header_name(phrase.tree), len(layout))
+    elif phrase.name == 'import':
+        layout.setdefault(phrase.tree.content, len(layout))
+    elif phrase.name == 'import ? from ?':
+        layout.setdefault(phrase.questions[0], len(layout))
+    elif phrase.tree is not None:
+        bind_assignments(phrase.tree, layout)
+
+def cast_names(tree):
+    if tree.name == 'list':
+        return [name.content for name in tree.inner]
+    return [tree.content]
+
+def block_layout(phrases, i, j, layout):
+    casts = []
+    for phrase in block_phrases(phrases, i, j):
+        if phrase.tree is not None:
+            FRAME_OF[phrase.tree.origin] = layout
+        bind_phrase(phrase, layout)
+        if phrase.name == 'cast':
+            casts.append(phrase)
+
+    for cast in casts:
+        names = frozenset(cast_names(cast.tree))
+        # phrase ids survive edits, so they are not positions
+        k = phrases.index(cast, i, j + 1)
+        for phrase in block_phrases(phrases, k + 1, cast.end):
+            if phrase.tree is not None:
+                CASTS_OF[phrase.tree.origin] = CASTS_OF.get(phrase.tree.origin, NO_CASTS) | names
+    return layout
+
+def frame_layout(phrases, i, j, args):
+    origin = phrases[i - 1].tree.origin
+    if origin in LAYOUTS:
+        return LAYOUTS[origin]
+
+    layout = Layout(FRAME_OF.get(origin))
+    for arg in args:
+        layout.setdefault(arg[1], len(layout))
+
+    LAYOUTS[origin] = block_layout(phrases, i, j, layout)
+    return layout
+
+BUILTINS = ('len', 'range', 'sys', 'print', '__name__', '__main__', 'str', 'ord', 'chr')
+
+def module_layout(phrases):
+    if not phrases:
+        return Layout(None)
+    if phrases[0] in LAYOUTS:
+        return LAYOUTS[phrases[0]]
+
+    layout = Layout(None)
+    for name in BUILTINS:
+        layout[name] = len(layout)
+
+    LAYOUTS[phrases[0]] = block_layout(phrases, 0, len(phrases) - 1, layout)
+    return layout
+
+def mark_comprehension(tree, layout):
+    COMPREHENSIONS[tree] = layout
+    if type(tree) != tokenize.Token:
+        for inner in tree.inner:
+            mark_comprehension(inner, layout)
+
+# [expr for variables in container if cond], with cond None when missing
+def comprehension_parts(tree):
+    assert len(tree.inner) in (3, 5) and tree.inner[1].content == 'for'
+    assert tree.inner[2].name == 'assignment' and tree.inner[2].inner[1].content == 'in'
+
+    if len(tree.inner) > 3:
+        assert tree.inner[3].content == 'if'
+        cond = tree.inner[4]
+    else:
+        cond = None
+
+    return tree.inner[0], tree.inner[2].inner[0], tree.inner[2].inner[2], cond
+
+def comprehension_id(tree):
+    return tree.phrase_id + ':' + str(tree.inner[1].i)
+
+# comprehension variables get their own frame; the container still runs in
+# the enclosing one
+def comprehension_layout(tree):
+    expr, variables, container, cond = comprehension_parts(tree)
+
+    layout = Layout(COMPREHENSIONS.get(tree, FRAME_OF.get(tree.origin)))
+    bind_targets(variables, layout)
+
+    mark_comprehension(expr, layout)
+    mark_comprehension(variables, layout)
+    if cond is not None:
+        mark_comprehension(cond, layout)
+    return layout
+
 def func(header, phrases, i, min_level, scope):
     tree = header.tree
 
@@ -390,10 +661,12 @@ def func(header, phrases, i, min_level, scope):
     args = get_args(tree.inner[1])
 
     j = skip_block(phrases, i, min_level)
-    is_generator = yield_lookup(phrases, i, j)
+    is_generator = phrases[i - 1].has_yield
     
+    layout = frame_layout(phrases, i, j, args)
+
     #print('F', phrases[i - 1].tree.phrase_id, name)
-    f = F(phrases, i, args, scope, is_generator)
+    f = F(phrases, i, args, scope, is_generator, layout)
     scope.update(name, f)
 
     return j
@@ -457,56 +730,36 @@ def iface_func(header, phrases, i, min_level, scope):
         
     LIB.func_args[scope_id] = tuple(args)
     LIB.args_cast[scope_id] = tuple([a[0] + ':' if a[0] else None for a in args])
-    LIB.update_type(scope.scope_id, name, '*f:' + scope_id)
+    LIB.update_type(scope.scope_id, name, lattice.named('*f', scope_id))
 
 def ifelse(phrases, j, level, scope):
-    cond = phrases[j].tree
-    is_true = val(cond, scope)
+    end = j
+    while end >= 0:
+        s = phrases[end]
+        if end != j:
+            # elif and else headers run here, not through gblock
+            if (CONVERGE is not None or COVERAGE) and s not in COVERED:
+                COVERED.add(s)
+            if PROFILE:
+                PHRASE_COUNTS[s] = PHRASE_COUNTS.get(s, 0) + 1
+        j, end = end, s.orelse
+
+        if s.name != 'else' and not val(s.tree, scope):
+            continue
 
-    if is_true:
         goto = yield from gblock(phrases, j + 1, level + 1, scope)
         if not goto._end:
             return goto
+        break
 
-        i = goto.i + 1
-    else:
-        i = skip_block(phrases, j + 1, level + 1) + 1
-
-    while i < len(phrases):
-        s = phrases[i]
-
-        if s.level > level:
-            raise BadIndent(i)
-        if s.level < level:
-            return Goto('end', None, i - 1)
-        if not s.name == 'else' and not s.name == 'elif':
-            return Goto('end', None, i - 1)
-
-        if is_true:
-            i = skip_block(phrases, i + 1, level + 1) + 1
-            continue
-
-        if s.name == 'else':
-            goto = yield from gblock(phrases, i + 1, level + 1, scope)
-            return goto
-        
-        is_true = val(s.tree, scope)
-        if is_true:
-            goto = yield from gblock(phrases, i + 1, level + 1, scope)
-            if not goto._end:
-                return goto
-
-            i = goto.i + 1
-        else:
-            i = skip_block(phrases, i + 1, level + 1) + 1
-
-    return Goto('end', None, i - 1)
+    while phrases[j].orelse >= 0:
+        j = phrases[j].orelse
+    return Goto('end', None, phrases[j].end)
 
 def iterate_over(value):
     if type(value) == Generator:
-        while True:
-            #print('ITERATING')
-            yield value.next()
+        yield from value.code
+        return
 
     yield from value
 
@@ -539,33 +792,19 @@ def set_index(container, i, v):
 def adhoc_generator(tree, glob_loc, loc):
     pass
 
-def list_comprehension(tree, parent_scope):
-    assert len(tree.inner) >= 5 and tree.inner[1].content == 'for' and tree.inner[3].content == 'in'
-
-    expr = tree.inner[0]
-    variables = tree.inner[2]
-    container = tree.inner[4]
-
-    if len(tree.inner) > 5:
-        assert tree.inner[5].content == 'if'
-        assert len(tree.inner) == 7
-        cond = tree.inner[6]
-        do_filter = True 
-    else:
-        do_filter = False
+def list_comprehension(tree, layout, parent_scope):
+    expr, variables, container, cond = comprehension_parts(tree)
 
     lst = []
+    scope = Frame(parent_scope, layout, comprehension_id(tree))
 
-    scope_id = tree.phrase_id + ':' + str(tree.inner[1].content.i)
-    scope = Scope(parent_scope, False, scope_id)
-
-    for v in iterate_over(container):
-        _assign(variables, v, scope)
-        if do_filter and not val(cond, scope):
+    for v in iterate_over(val(container, parent_scope)):
+        _assign(variables, v, scope, scope)
+        if cond is not None and not val(cond, scope):
             continue
         lst.append(val(expr, scope))
 
-    return lst
+    return builtin.List(lst, tree.phrase_id)
 
 def _assign(ltree, rvalue, scope, search):
     if ltree.name in ('list', '()', '[]'):
@@ -601,180 +840,347 @@ def expand_range(tree):
 
     return ijk
 
-def val(tree, scope):
-    return objval(tree, scope, scope)
-
 def escape(s):
     return s.replace('\\n', '\n').replace('\\0', '\0')
 
-def objval(tree, scope, obj):
-    if tree.name == 'binary' or tree.name == 'compare':
-        left = val(tree.inner[0], scope)
-        right = val(tree.inner[2], scope)
-        if tree.inner[1].content == '+':
-            return left + right
-        if tree.inner[1].content == '-':
-            return left - right
-        elif tree.inner[1].content == 'and':
-            return left and right
-        elif tree.inner[1].content == 'or':
-            return left or right
-        elif tree.inner[1].content == '/':
-            return left / right
-        elif tree.inner[1].content == '*':
-            return left * right
-        elif tree.inner[1].content == '%':
-            return left % right
-        elif tree.inner[1].content == '&':
-            return left & right
-        elif tree.inner[1].content == '^':
-            return left ^ right
-        elif tree.inner[1].content == '|':
-            return left | right
-        elif tree.inner[1].content == '<=':
-            return left <= right
-        elif tree.inner[1].content == '>=':
-            return left >= right
-        elif tree.inner[1].content == '==':
-            return left == right
-        elif tree.inner[1].content == '!=':
-            return left != right
-        elif tree.inner[1].content == '<':
-            return left < right
-        elif tree.inner[1].content == '>':
-            return left > right
-        elif tree.inner[1].content == 'is in':
-            return right.contains(left)
-        elif tree.inner[1].content == 'is not in':
-            return not right.contains(left)
-        else:
-            assert False, tree.inner[1].content
-    elif tree.name == 'assignment':
-        ltree = tree.inner[0]
-        right = val(tree.inner[2], scope)
-
-        assert tree.inner[1].name == 'sign'
-
-        if tree.inner[1].content != '=':
-            left = val(ltree, scope)
-            if tree.inner[1].content == '*=':
-                right = left * right
-            elif tree.inner[1].content == '+=':
-                right = left + right
-            elif tree.inner[1].content == '-=':
-                right = left - right
-            elif tree.inner[1].content == '/=':
-                right = left / right
-            elif tree.inner[1].content == '*=':
-                right = left * right
-            elif tree.inner[1].content == '%=':
-                right = left % right
-            elif tree.inner[1].content == '&=':
-                right = left & right
-            elif tree.inner[1].content == '^=':
-                right = left ^ right
-            elif tree.inner[1].content == '|=':
-                right = left | right
-            else:
-                assert False, tree.inner[1].content
-
-        _assign(ltree, right, obj, scope)
-        if ltree.name == 'name':
-            return objval(ltree, scope, obj)
+BINARY = {'+': operator.add, '-': operator.sub, '/': operator.truediv, '*': operator.mul,
+          '%': operator.mod, '&': operator.and_, '^': operator.xor, '|': operator.or_,
+          '<=': operator.le, '>=': operator.ge, '==': operator.eq, '!=': operator.ne,
+          '<': operator.lt, '>': operator.gt,
+          'and': lambda left, right: left and right,
+          'or': lambda left, right: left or right,
+          'is in': lambda left, right: right.contains(left),
+          'is not in': lambda left, right: not right.contains(left)}
+
+INPLACE = {'*=': operator.mul, '+=': operator.add, '-=': operator.sub, '/=': operator.truediv,
+           '%=': operator.mod, '&=': operator.and_, '^=': operator.xor, '|=': operator.or_}
+
+UNARY = {'-': operator.neg, '~': operator.invert, 'not': operator.not_}
+
+KEYWORDS = {'True': True, 'False': False, 'None': None}
+
+# every tree is compiled once into a closure taking (scope, obj), where scope
+# resolves the operands and obj the names, as objval did
+CODE = {}
+
+def compiled(tree):
+    code = CODE.get(tree)
+    if code is None:
+        compiler = COMPILERS.get(tree.name, compile_unknown)
+        code = CODE[tree] = compiler(tree)
+    return code
+
+def failure(message):
+    def fail(scope, obj):
+        assert False, message
+    return fail
+
+def compile_unknown(tree):
+    return failure(tree.name)
+
+def compile_binary(tree):
+    left = compiled(tree.inner[0])
+    right = compiled(tree.inner[2])
+    op = BINARY.get(tree.inner[1].content)
+    if op is None:
+        return failure(tree.inner[1].content)
+
+    def binary(scope, obj):
+        return op(left(scope, scope), right(scope, scope))
+    return binary
+
+def compile_assignment(tree):
+    ltree = tree.inner[0]
+    right = compiled(tree.inner[2])
+    result = compiled(ltree) if ltree.name == 'name' else None
+
+    if tree.inner[1].name != 'sign':
+        return failure(tree.inner[1].name)
+
+    if tree.inner[1].content == '=' and ltree.name == 'name' and tree.inner[2].name in CONSTANT:
+        content = ltree.content
+        value, tp = constant(tree.inner[2])
+
+        def assign_constant(scope, obj):
+            obj.update(content, value, tp)
+            return result(scope, obj)
+        return assign_constant
+
+    if tree.inner[1].content == '=':
+        def assign(scope, obj):
+            _assign(ltree, right(scope, scope), obj, scope)
+            if result is not None:
+                return result(scope, obj)
+            return None
+        return assign
+
+    op = INPLACE.get(tree.inner[1].content)
+    if op is None:
+        return failure(tree.inner[1].content)
+    left = compiled(ltree)
+
+    def assign_inplace(scope, obj):
+        value = right(scope, scope)
+        _assign(ltree, op(left(scope, scope), value), obj, scope)
+        if result is not None:
+            return result(scope, obj)
         return None
-    elif tree.name == 'name':
-        v = obj.find(tree.content)
-        return v
-    elif tree.name == 'digit':
-        return float(tree.content)
-    elif tree.name == 'string':
-        return builtin.String(escape(tree.content[1:-1]))
-    elif tree.name == 'attr':
-        owner = objval(tree.inner[0], scope, obj)
-        return objval(tree.inner[2], scope, owner.scope)
-    elif tree.name == 'call':
-        assert tree.inner[1].name == '()'
-        args_val = val(tree.inner[1], scope)
+    return assign_inplace
+
+def resolve(layout, name):
+    depth = 0
+    while layout is not None:
+        if name in layout:
+            return depth, layout[name]
+        layout = layout.parent
+        depth += 1
+    return None, None
+
+# names are resolved to a frame depth and slot once; the slot may still be
+# unset (or the name bound outside the layout), and then it is searched for
+def compile_name(tree):
+    content = tree.content
+    if tree in COMPREHENSIONS:
+        layout = COMPREHENSIONS[tree]
+        casts = NO_CASTS
+    else:
+        layout = FRAME_OF.get(tree.origin)
+        casts = CASTS_OF.get(tree.origin, NO_CASTS)
+
+    depth, slot = resolve(layout, content)
+    if depth is None:
+        return compile_member(tree)
+
+    if depth == 0 and content in casts:
+        def local_cast(scope, obj):
+            value = obj.slots[slot]
+            if value is UNSET:
+                return obj.find(content)
+            return value.v
+        return local_cast
+
+    if depth == 0:
+        def local(scope, obj):
+            value = obj.slots[slot]
+            if value is UNSET:
+                return obj.find(content)
+            return value
+        return local
+
+    if depth == 1:
+        def enclosing(scope, obj):
+            frame = obj.parent
+            value = frame.slots[slot]
+            if value is UNSET or frame.casts:
+                return obj.find(content)
+            return value
+        return enclosing
+
+    def outer(scope, obj):
+        frame = obj.parent
+        for _ in range(depth - 1):
+            frame = frame.parent
+        value = frame.slots[slot]
+        if value is UNSET or frame.casts:
+            return obj.find(content)
+        return value
+    return outer
+
+def compile_member(tree):
+    if tree.name != 'name':
+        return compiled(tree)
+    content = tree.content
+
+    def name(scope, obj):
+        return obj.find(content)
+    return name
+
+# literals are immutable, so each distinct one is made once and shared,
+# together with its type
+CONSTANTS = {}
+CONSTANT = {'digit': float, 'string': lambda content: builtin.String(escape(content[1:-1]))}
+
+def constant(tree):
+    key = (tree.name, tree.content)
+    pooled = CONSTANTS.get(key)
+    if pooled is None:
+        value = CONSTANT[tree.name](tree.content)
+        pooled = CONSTANTS[key] = (value, Types.typeof(value))
+    return pooled
+
+def compile_digit(tree):
+    value, _ = constant(tree)
+
+    def digit(scope, obj):
+        return value
+    return digit
+
+def compile_string(tree):
+    value, _ = constant(tree)
+
+    def string(scope, obj):
+        return value
+    return string
+
+def compile_attr(tree):
+    owner = compiled(tree.inner[0])
+    member = compile_member(tree.inner[2])
+
+    def attr(scope, obj):
+        return member(scope, owner(scope, obj).scope)
+    return attr
+
+def compile_call(tree):
+    assert tree.inner[1].name == '()'
+    arguments = compiled(tree.inner[1])
+    single = len(tree.inner[1].inner) > 0 and tree.inner[1].inner[0].name != 'list'
 
-        if len(tree.inner[1].inner) > 0 and tree.inner[1].inner[0].name != 'list':
-            args = tuple([args_val])
-        else:
-            args = args_val
+    if tree.inner[0].name == 'attr' and tree.inner[0].inner[-1].name == 'name':
+        owner_code = compiled(tree.inner[0].inner[0])
+        method = compile_member(tree.inner[0].inner[-1])
+
+        def method_call(scope, obj):
+            args = arguments(scope, scope)
+            if single:
+                args = (args,)
 
-        if tree.inner[0].name == 'attr' and tree.inner[0].inner[-1].name == 'name':
-            owner = objval(tree.inner[0].inner[0], scope, obj)
-            f = objval(tree.inner[0].inner[-1], owner.scope, owner.scope)
+            owner = owner_code(scope, obj)
+            f = method(owner.scope, owner.scope)
             if owner.scope.is_instance:
                 return f.call((owner.scope,) + args)
             else:
                 return f.call(args)
+        return method_call
+
+    callee = compiled(tree.inner[0])
+
+    def call(scope, obj):
+        args = arguments(scope, scope)
+        if single:
+            args = (args,)
+        return callee(scope, obj).call(args)
+    return call
+
+def compile_index(tree):
+    container = compiled(tree.inner[0])
+    i = compiled(tree.inner[1].inner[0])
+
+    def index_of(scope, obj):
+        mem = container(scope, obj)
+        return index(mem, i(scope, scope))
+    return index_of
 
-        callee = objval(tree.inner[0], scope, obj)
-        return callee.call(args)
-    elif tree.name == 'index':
-        mem = objval(tree.inner[0], scope, obj)
-        i = val(tree.inner[1].inner[0], scope)
-        return index(mem, i)
-    elif tree.name == 'list':
-        return tuple(val(v, scope) for v in tree.inner)
-    elif tree.name == '()':
-        if len(tree.inner) == 0:
+def compile_list(tree):
+    items = [compiled(v) for v in tree.inner]
+
+    def make_tuple(scope, obj):
+        return tuple([item(scope, scope) for item in items])
+    return make_tuple
+
+def compile_parens(tree):
+    if len(tree.inner) == 0:
+        def empty(scope, obj):
             return tuple()
-        elif len(tree.inner) == 1:
-            return val(tree.inner[0], scope)
-        else:
-            return adhoc_generator(tree, scope)
-    elif tree.name == '[]':
-        if len(tree.inner) == 0:
+        return empty
+
+    if len(tree.inner) == 1:
+        inner = compiled(tree.inner[0])
+
+        def parens(scope, obj):
+            return inner(scope, scope)
+        return parens
+
+    def generator(scope, obj):
+        return adhoc_generator(tree, scope)
+    return generator
+
+def compile_brackets(tree):
+    if len(tree.inner) == 0:
+        def empty(scope, obj):
             return builtin.List([], tree.phrase_id)
-        elif len(tree.inner) == 1:
-            v = val(tree.inner[0], scope)
-            return builtin.List(v, tree.phrase_id) if tree.name == 'list' else v
-        else:
-            return list_comprehension(tree, scope)
-    elif tree.name == '{}':
-        if len(tree.inner) == 0:
-            return builtin.Dict({}, tree.phrase_id)
-        elif len(tree.inner) > 1:
-            return dict_comprehension(tree, scope)
-        else:
-            if tree.inner[0].name == 'list':
-                items = val(tree.inner[0], scope)
-            elif len(tree.inner[0].inner) > 0:
-                items = (val(tree.inner[0], scope),)
-            else:
-                return builtin.Dict({}, tree.phrase_id)
+        return empty
 
-            if type(items[0]) == Range:
-                assert all (item.i.flag and item.j.flag for item in items)
-                return builtin.Dict({item.i.v: item.j.v for item in items}, tree.phrase_id)
-            else:
-                return builtin.Set({item for item in items}, tree.phrase_id)
-    elif tree.name == 'range':
-        i, j, k = [RangeRef(v, scope) for v in expand_range(tree)]
-        return Range(i, j, k)
-    elif tree.name == 'keyword':
-        if tree.content == 'True':
-            return True
-        if tree.content == 'False':
-            return False
-        if tree.content == 'None':
-            return None
-        assert False, tree.content
-    elif tree.name == 'unary':
-        if tree.inner[0].content == '-':
-            return -val(tree.inner[1], scope)
-        if tree.inner[0].content == '~':
-            return ~val(tree.inner[1], scope)
-        if tree.inner[0].content == 'not':
-            return not val(tree.inner[1], scope)
-        assert False, tree.inner[0].content
+    if len(tree.inner) == 1:
+        inner = compiled(tree.inner[0])
+
+        def brackets(scope, obj):
+            return inner(scope, scope)
+        return brackets
+
+    layout = comprehension_layout(tree)
+
+    def comprehension(scope, obj):
+        return list_comprehension(tree, layout, scope)
+    return comprehension
+
+def compile_braces(tree):
+    def braces(scope, obj):
+        return set_or_dict(tree, scope)
+    return braces
+
+def set_or_dict(tree, scope):
+    if len(tree.inner) == 0:
+        return builtin.Dict({}, tree.phrase_id)
+    elif len(tree.inner) > 1:
+        return dict_comprehension(tree, scope)
+
+    if tree.inner[0].name == 'list':
+        items = val(tree.inner[0], scope)
+    elif len(tree.inner[0].inner) > 0:
+        items = (val(tree.inner[0], scope),)
+    else:
+        return builtin.Dict({}, tree.phrase_id)
+
+    if type(items[0]) == Range:
+        assert all (item.i.flag and item.j.flag for item in items)
+        return builtin.Dict({item.i.v: item.j.v for item in items}, tree.phrase_id)
     else:
-        assert False, tree.name
+        return builtin.Set({item for item in items}, tree.phrase_id)
+
+def compile_range(tree):
+    ijk = expand_range(tree)
+
+    def make_range(scope, obj):
+        i, j, k = [RangeRef(v, scope) for v in ijk]
+        return Range(i, j, k)
+    return make_range
+
+def compile_keyword(tree):
+    if tree.content not in KEYWORDS:
+        return failure(tree.content)
+    value = KEYWORDS[tree.content]
+
+    def keyword(scope, obj):
+        return value
+    return keyword
+
+def compile_unary(tree):
+    op = UNARY.get(tree.inner[0].content)
+    if op is None:
+        return failure(tree.inner[0].content)
+    operand = compiled(tree.inner[1])
 
-def anonymous(phrase_id):
-    module, line = phrase_id.rsplit(':', maxsplit=1)
-    return f'@{line}'
+    def unary(scope, obj):
+        return op(operand(scope, scope))
+    return unary
+
+COMPILERS = {'binary': compile_binary, 'compare': compile_binary, 'assignment': compile_assignment,
+             'name': compile_name, 'digit': compile_digit, 'string': compile_string,
+             'attr': compile_attr, 'call': compile_call, 'index': compile_index,
+             'list': compile_list, '()': compile_parens, '[]': compile_brackets, '{}': compile_braces,
+             'range': compile_range, 'keyword': compile_keyword, 'unary': compile_unary}
+
+def val(tree, scope):
+    code = CODE.get(tree)
+    if code is None:
+        code = compiled(tree)
+    return code(scope, scope)
+
+def objval(tree, scope, obj):
+    return compiled(tree)(scope, obj)
+
+def anonymous(index):
+    return f'@{index}'
 
 def synchronized_block(phrases, i, min_level, scope):
     g = gblock(phrases, i, min_level, scope)
@@ -785,6 +1191,139 @@ def synchronized_block(phrases, i, min_level, scope):
         except StopIteration as ex:
             return ex.value
 
+def statement_unit(s, phrases, j, level, scope, reraise):
+    return func(s, phrases, j + 1, level + 1, scope)
+
+def statement_class(s, phrases, j, level, scope, reraise):
+    j = yield from obj(s, phrases, j + 1, level + 1, scope)
+    return j
+
+def statement_import(s, phrases, j, level, scope, reraise):
+    assert s.tree.name == 'name', s.tree.name
+    yield ImportRequest(s.tree.content)
+    scope.update(s.tree.content, Module(Scope.MODULES.get(s.tree.content)))
+    return j
+
+def statement_import_from(s, phrases, j, level, scope, reraise):
+    fullname = s.questions[1] + '.' + s.questions[0]
+    yield ImportRequest(fullname, name=s.questions[0])
+    scope.update(s.questions[0], Module(Scope.MODULES.get(fullname)))
+    return j
+
+def statement_return(s, phrases, j, level, scope, reraise):
+    value = val(s.tree, scope) if s.tree else None
+    return Goto('return', value, j)
+
+def statement_yield(s, phrases, j, level, scope, reraise):
+    value = val(s.tree, scope) if s.tree else None
+    LIB.observe(scope.seen, scope.scope_id, '', value)
+    yield value
+    return j
+
+def statement_raise(s, phrases, j, level, scope, reraise):
+    if s.tree is not None:
+        raise val(s.tree, scope)
+    else:
+        assert reraise is not None
+        raise reraise
+
+def statement_break(s, phrases, j, level, scope, reraise):
+    return Goto('break', None, j)
+
+def statement_continue(s, phrases, j, level, scope, reraise):
+    return Goto('continue', None, j)
+
+def statement_pass(s, phrases, j, level, scope, reraise):
+    return j
+
+def statement_assert(s, phrases, j, level, scope, reraise):
+    if s.tree.name == 'list':
+        cond = val(s.tree.inner[0], scope)
+        mess = val(s.tree.inner[1], scope)
+    else:
+        cond = val(s.tree, scope)
+        mess = "Failure"
+    assert cond, mess
+    return j
+
+def statement_for(s, phrases, j, level, scope, reraise):
+    assert s.tree.name == 'assignment' and s.tree.inner[1].content == 'in'
+
+    value = val(s.tree.inner[2], scope)
+    LIB.observe(scope.seen, scope.scope_id, anonymous(s.tree.inner[2].origin.index), value)
+
+    watch = Watch() if CONVERGE is not None else None
+    for vals in iterate_over(value):
+        _assign(s.tree.inner[0], vals, scope, scope)
+
+        goto = yield from gblock(phrases, j + 1, level + 1, scope)
+        if goto._return:
+            return goto
+        elif goto._break:
+            break
+        else:
+            assert goto._continue or goto._end
+
+        if watch is not None and watch.converged():
+            break
+    return s.end
+
+def statement_while(s, phrases, j, level, scope, reraise):
+    watch = Watch() if CONVERGE is not None else None
+    while val(s.tree, scope):
+        goto = yield from gblock(phrases, j + 1, level + 1, scope)
+        if goto._return:
+            return goto
+        elif goto._break:
+            break
+        else:
+            assert goto._continue or goto._end
+
+        if watch is not None and watch.converged():
+            break
+    return s.end
+
+def statement_if(s, phrases, j, level, scope, reraise):
+    goto = yield from ifelse(phrases, j, level, scope)
+    if not goto._end:
+        return goto
+    return goto.i
+
+def statement_cast(s, phrases, j, level, scope, reraise):
+    scope.cast(s.tree.phrase_id, cast_names(s.tree))
+
+    goto = yield from gblock(phrases, j + 1, level + 1, scope)
+    if goto._return:
+        return goto
+    else:
+        assert False
+
+    scope.cast_pop()
+    return s.end
+
+def statement_interface(s, phrases, j, level, scope, reraise):
+    j = yield from iface(s, phrases, j + 1, level + 1, scope)
+    return j
+
+def statement_interface_unit(s, phrases, j, level, scope, reraise):
+    iface_func(s, phrases, j + 1, level + 1, scope)
+    return j
+
+def statement_expr(s, phrases, j, level, scope, reraise):
+    assert s.tree is not None
+    val(s.tree, scope)
+    return j
+
+# statements that run straight through, and those that may yield to the caller
+STATEMENTS = {'unit': statement_unit, 'return': statement_return, 'raise': statement_raise,
+              'break': statement_break, 'continue': statement_continue, 'pass': statement_pass,
+              'assert': statement_assert, 'interface-unit': statement_interface_unit,
+              'expr': statement_expr}
+
+BLOCKS = {'class': statement_class, 'import': statement_import, 'import ? from ?': statement_import_from,
+          'yield': statement_yield, 'for': statement_for, 'while': statement_while, 'if': statement_if,
+          'cast': statement_cast, 'interface': statement_interface}
+
 def gblock(phrases, i, min_level, scope, reraise=None):
     level = -1
     j = i - 1
@@ -801,110 +1340,34 @@ def gblock(phrases, i, min_level, scope, reraise=None):
 
         if DEBUG:
             print(s.debug)
-        if s.name == 'unit':
-            j = func(s, phrases, j + 1, level + 1, scope)
-        elif s.name == 'class':
-            j = yield from obj(s, phrases, j + 1, level + 1, scope)
-        elif s.name == 'import':
-            assert s.tree.name == 'name', s.tree.name
-            yield ImportRequest(s.tree.content)
-            scope.update(s.tree.content, Module(Scope.MODULES.get(s.tree.content)))
-        elif s.name == 'import ? from ?':
-            fullname = s.questions[1] + '.' + s.questions[0]
-            yield ImportRequest(fullname, name=s.questions[0])
-            scope.update(s.questions[0], Module(Scope.MODULES.get(fullname)))
-        elif s.name == 'return':
-            value = val(s.tree, scope) if s.tree else None
-            return Goto('return', value, j)
-        elif s.name == 'yield':
-            value = val(s.tree, scope) if s.tree else None
-            LIB.update_type(scope.scope_id, '', Types.typeof(value))
-            yield value
-        elif s.name == 'raise':
-            if s.tree is not None:
-                raise val(s.tree, scope)
-            else:
-                assert reraise is not None
-                raise reraise
-        elif s.name == 'break':
-            return Goto('break', None, j)
-        elif s.name == 'continue':
-            return Goto('continue', None, j)
-        elif s.name == 'pass':
-            pass
-        elif s.name == 'assert':
-            if s.tree.name == 'list':
-                cond = val(s.tree.inner[0], scope)
-                mess = val(s.tree.inner[1], scope)
-            else:
-                cond = val(s.tree, scope)
-                mess = "Failure"
-            assert cond, mess
-        elif s.name == 'for':
-            assert s.tree.name == 'assignment' and s.tree.inner[1].content == 'in'
-
-            value = val(s.tree.inner[2], scope)
-            LIB.update_type(scope.scope_id, anonymous(s.tree.inner[2].phrase_id), Types.typeof(value))
-
-            for vals in iterate_over(value):
-                _assign(s.tree.inner[0], vals, scope, scope)
-
-                goto = yield from gblock(phrases, j + 1, level + 1, scope)
-                if goto._return:
-                    return goto
-                elif goto._break:
-                    break
-                else:
-                    assert goto._continue or goto._end
-            j = skip_block(phrases, j + 1, level + 1)
-        elif s.name == 'while':
-            while val(s.tree, scope):
-                goto = yield from gblock(phrases, j + 1, level + 1, scope)
-                if goto._return:
-                    return goto
-                elif goto._break:
-                    break
-                else:
-                    assert goto._continue or goto._end
-            j = skip_block(phrases, j + 1, level + 1)
-        elif s.name == 'if':
-            goto = yield from ifelse(phrases, j, level, scope)
-            if not goto._end:
-                return goto
-            j = goto.i
-        elif s.name == 'cast':
-            if s.tree.name == 'list':
-                names = [name.content for name in s.tree.inner]
-            else:
-                names = [s.tree.content]
-            scope.cast(s.tree.phrase_id, names)
+        if (CONVERGE is not None or COVERAGE) and s not in COVERED:
+            COVERED.add(s)
+        if PROFILE:
+            PHRASE_COUNTS[s] = PHRASE_COUNTS.get(s, 0) + 1
 
-            goto = yield from gblock(phrases, j + 1, level + 1, scope)
-            if goto._return:
-                return goto
-            else:
-                assert False
-
-            scope.cast_pop()
-            j = skip_block(phrases, j + 1, level + 1)
-        elif s.name == 'interface':
-            j = yield from iface(s, phrases, j + 1, level + 1, scope)
-        elif s.name == 'interface-unit':
-            iface_func(s, phrases, j + 1, level + 1, scope)
+        if s.name in STATEMENTS:
+            goto = STATEMENTS[s.name](s, phrases, j, level, scope, reraise)
         else:
-            assert s.name == 'expr', s.name
-            assert s.tree is not None
-            val(s.tree, scope)
+            assert s.name in BLOCKS, s.name
+            goto = yield from BLOCKS[s.name](s, phrases, j, level, scope, reraise)
+
+        if type(goto) == Goto:
+            return goto
+        j = goto
 
     return Goto('end', None, j)
 
 def _builtin_sys(inp):
-    def get_input():
-        return builtin.String(inp)
+    if type(inp) == str:
+        inp = inp.encode()
+    if type(inp) == bytes:
+        inp = io.BytesIO(inp)
+    stdin = builtin.Input(inp)
 
     system = Module(Scope(None, False, 'sys'))
     system.scope.vars['stdin'] = Module(Scope(None, False, 'stdin'))
-    system.scope.vars['stdin'].scope.vars['read'] = builtin.Function(get_input, False)
+    system.scope.vars['stdin'].scope.vars['read'] = builtin.Function(stdin.read, False)
+    system.scope.vars['stdin'].scope.vars['readline'] = builtin.Function(stdin.readline, False)
 
     return system
 
@@ -921,41 +1384,35 @@ def _add_builtins(scope, silent):
     def chr_wrap(s):
         return ' ' + s.v + ' '
 
-    scope.vars['len'] = builtin.LEN
-    scope.vars['range'] = builtin.RANGE
-    scope.vars['sys'] = _builtin_sys('')
+    scope.bind('len', builtin.LEN)
+    scope.bind('range', builtin.RANGE)
+    scope.bind('sys', _builtin_sys(''))
     if silent:
-        scope.vars['print'] = builtin.Function(silent_print, False)
+        scope.bind('print', builtin.Function(silent_print, False))
     else:
-        scope.vars['print'] = builtin.PRINT
-    scope.vars['__name__'] = builtin.String('__main__')
-    scope.vars['__main__'] = builtin.String('__main__')
-    scope.vars['str'] = builtin.Function(make_string, False)
-    scope.vars['ord'] = builtin.Function(ord_wrap, False)
-    scope.vars['chr'] = builtin.Function(chr_wrap, False)
+        scope.bind('print', builtin.PRINT)
+    scope.bind('__name__', builtin.String('__main__'))
+    scope.bind('__main__', builtin.String('__main__'))
+    scope.bind('str', builtin.Function(make_string, False))
+    scope.bind('ord', builtin.Function(ord_wrap, False))
+    scope.bind('chr', builtin.Function(chr_wrap, False))
 
     builtin.Types.typeof = Types.typeof
 
-def enrich_trees(tree, phrase_id):
-    tree.phrase_id = phrase_id
-
-    if type(tree) == tokenize.Token:
-        return
-
-    for inner in tree.inner:
-        enrich_trees(inner, phrase_id)
-
 def enrich_phrases(phrases, module_name):
     for i, phrase in enumerate(phrases):
-        phrase_id = module_name + ':' + str(i)
         if phrase.tree is not None:
-            enrich_trees(phrase.tree, phrase_id)
+            phrase.tree.origin.phrase_id = module_name + ':' + str(i)
+            phrase.tree.origin.index = i
+
+def add_sys(inp):
+    Scope.MODULES['sys'] = _builtin_sys(inp).scope
 
 def load_module(name, phrases, silent=True):
     if name in Scope.MODULES:
         return
 
-    scope = Scope(None, False, name)
+    scope = Frame(None, module_layout(phrases), name)
     _add_builtins(scope, silent)
 
     Scope.MODULES[name] = scope
@@ -969,16 +1426,20 @@ def loader_block(phrases, scope):
             Scope.MODULES[imp.module] = Scope(None, False, imp)
 
 def interpret(s, module_name='__main__', silent=False):
-    phrases = list(scanner.scan_text(s))
+    phrases = scanner.index_blocks(list(scanner.scan_text(s)))
 
     enrich_phrases(phrases, module_name)
 
-    scope = Scope(None, False, module_name)
+    scope = Frame(None, module_layout(phrases), module_name)
     _add_builtins(scope, silent)
 
     loader_block(phrases, scope)
     return phrases
 
+def print_observations():
+    print('observations skipped:', LIB.skipped + builtin.Types.skipped,
+          'merged:', LIB.merged + builtin.Types.merged, file=sys.stderr)
+
 def print_types():
     for scope, names in LIB.types.items():
         print('Scope:', scope)
@@ -0,0 +1,93 @@
+class Type(str):
+    # interned, so equal types are the same object; the text is the old
+    # string encoding and is what definer, expressions and compiler read
+
+    def __reduce__(self):
+        return parse, (str(self),)
+
+TYPES = {}
+NAMED = {}
+TUPLES = {}
+MERGES = {}
+
+def separator(depth):
+    return '&' + str(depth) + '&'
+
+def intern(text, kind, payload, items=None, depth=None):
+    tp = TYPES.get(text)
+    if tp is None:
+        tp = TYPES[text] = Type(text)
+        tp.kind = kind
+        tp.payload = payload
+        tp.items = items
+        tp.depth = depth
+    return tp
+
+def named(kind, payload=''):
+    key = (kind, payload)
+    tp = NAMED.get(key)
+    if tp is None:
+        tp = NAMED[key] = intern(kind + ':' + payload, kind, payload)
+    return tp
+
+def tuple_of(items, depth):
+    key = (items, depth)
+    tp = TUPLES.get(key)
+    if tp is None:
+        payload = separator(depth).join(items)
+        tp = TUPLES[key] = intern('tuple:' + payload, 'tuple', payload, items, depth)
+    return tp
+
+def parse(text, depth=0):
+    tp = TYPES.get(text)
+    if tp is not None:
+        return tp
+
+    kind, _, payload = text.partition(':')
+    if kind != 'tuple':
+        return named(kind, payload)
+
+    if payload:
+        items = tuple(parse(item, depth + 1) for item in payload.split(separator(depth)))
+    else:
+        items = ()
+    return tuple_of(items, depth)
+
+DOUBLE = named('c', 'double')
+BOOL = named('c', 'bool')
+VOID = named('c', 'void')
+STR = named('str')
+CHAR = named('str', '1')
+LIST = named('list')
+REF = named('ref')
+RANGE = named('constructor', 'range')
+
+def unify(t1, t2):
+    if t1.kind == 'str' and t2.kind == 'str':
+        return STR
+    if t1.kind == 'tuple' and t2.kind == 'tuple':
+        if len(t1.items) != len(t2.items):
+            return LIST
+        items = []
+        for item1, item2 in zip(t1.items, t2.items):
+            item = merge(item1, item2)
+            if item is None:
+                return None
+            items.append(item)
+        return tuple_of(tuple(items), t1.depth)
+    if t1.kind == 'tuple' and t2.kind == 'list' or t2.kind == 'tuple' and t1.kind == 'list':
+        return LIST
+    if t1.kind == 'ref' or t2.kind == 'ref':
+        return REF
+    return None
+
+# None when the two types have no common type
+def merge(t1, t2):
+    if t1 is t2:
+        return t1
+
+    key = (t1, t2)
+    if key in MERGES:
+        return MERGES[key]
+    tp = MERGES[key] = unify(t1, t2)
+    return tp
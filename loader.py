@@ -1,23 +1,139 @@
 import interpreter
+import abstract
+import builtin
 import tokenize
 import scanner
+import hashlib
+import difflib
+import gc
 import pickle
 import os
+import re
+import importlib
+import json
+import mmap
+import traceback
+from concurrent.futures import ProcessPoolExecutor
 
-def enrich_trees(tree, phrase_id):
-    tree.phrase_id = phrase_id
+CACHE = '__hutcache__'
+FRONTEND = ('tokenize.py', 'parse.py', 'scanner.py', 'loader.py')
+INFERENCE = FRONTEND + ('interpreter.py', 'abstract.py', 'builtin.py', 'lattice.py')
 
-    if type(tree) == tokenize.Token:
-        return
+def frontend_version(filenames=FRONTEND):
+    h = hashlib.sha256()
+    base = os.path.dirname(os.path.abspath(__file__))
+    for filename in filenames:
+        with open(os.path.join(base, filename), 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+VERSION = frontend_version()
+TYPES_VERSION = frontend_version(INFERENCE)
 
-    for inner in tree.inner:
-        enrich_trees(inner, phrase_id)
+IMPORT = re.compile(r'[ \t]*import[ \t]+([\w.]+)(?:[ \t]+from[ \t]+([\w.]+))?[ \t]*$')
+CHUNK = 1 << 16
+CONVERGE = 256
 
-def enrich_phrases(phrases, module_name):
-    for i, phrase in enumerate(phrases):
-        phrase_id = module_name + ':' + str(i)
+# interpreter runs the program on its samples, abstract infers without running it
+ENGINE = interpreter
+PREFETCHED = {}
+
+def enrich_phrases(phrases, module_name, ids):
+    for i, phrase in zip(ids, phrases):
         if phrase.tree is not None:
-            enrich_trees(phrase.tree, phrase_id)
+            phrase.tree.origin.phrase_id = module_name + ':' + str(i)
+            phrase.tree.origin.index = i
+
+def phrase_key(phrase):
+    return phrase.level, phrase.debug
+
+def sentence_key(sentence):
+    level = sentence.tokens[0].i
+    return level, sentence.text[level:]
+
+def rescan(name, f, next_id, scanned):
+    sentences = [sentence for sentence in tokenize.lex_file(f) if sentence.tokens]
+    keys = [phrase_key(phrase) for phrase in scanned]
+    new_keys = [sentence_key(sentence) for sentence in sentences]
+    n, m = len(keys), len(new_keys)
+
+    # skip the unchanged head and tail so difflib only sees the edited region
+    head = 0
+    while head < n and head < m and keys[head] == new_keys[head]:
+        head += 1
+    tail = 0
+    while tail < n - head and tail < m - head and keys[n - 1 - tail] == new_keys[m - 1 - tail]:
+        tail += 1
+
+    new_scanned = scanned[:head]
+
+    matcher = difflib.SequenceMatcher(None, keys[head:n - tail], new_keys[head:m - tail], autojunk=False)
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+        if op == 'equal':
+            new_scanned += scanned[head + i1:head + i2]
+            continue
+
+        # unchanged phrases keep their ids, so types and generated C keyed by
+        # them stay valid; new phrases get ids past any used before
+        phrases = list(scanner.scan(sentences[head + j1:head + j2]))
+        enrich_phrases(phrases, name, range(next_id, next_id + len(phrases)))
+        next_id += len(phrases)
+        new_scanned += phrases
+
+    new_scanned += scanned[n - tail:]
+
+    return next_id, new_scanned
+
+def file_key(name, filename):
+    h = hashlib.sha256((name + '\0').encode())
+    with open(filename, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+def cached_scan(path_base, name, filename):
+    key = file_key(name, filename)
+    cachename = os.path.join(path_base, CACHE, name + '.pickle')
+    cached = None
+
+    try:
+        with open(cachename, 'rb') as f:
+            cached = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+
+    with open(filename) as f:
+        if cached is not None and cached[0] == VERSION:
+            _, cached_key, next_id, scanned = cached
+            if cached_key == key:
+                return scanned
+            next_id, scanned = rescan(name, f, next_id, scanned)
+        else:
+            scanned = list(scanner.scan_file(f))
+            next_id = len(scanned)
+            enrich_phrases(scanned, name, range(next_id))
+
+    try:
+        os.makedirs(os.path.join(path_base, CACHE), exist_ok=True)
+        with open(cachename + '.tmp', 'wb') as f:
+            pickle.dump((VERSION, key, next_id, scanned), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(cachename + '.tmp', cachename)
+    except OSError:
+        pass
+
+    return scanned
+
+def scan(path_base, name, filename):
+    # syntax trees hold no cycles, so the collector would only rescan
+    # hundreds of thousands of live nodes while they are built or loaded
+    gc.disable()
+    try:
+        return cached_scan(path_base, name, filename)
+    finally:
+        gc.enable()
 
 def splitname(filename, extension):
     assert filename.endswith(extension)
@@ -26,66 +142,443 @@ def splitname(filename, extension):
     name = full[:-len(extension)]
     return base, name
 
-def load(modules, base, name, extension, samples):
-    if name in modules:
-        return
-
+def module_path(base, name, extension):
     path = os.path.join(base, *name.split('.'))
     path_base, _ = os.path.split(path)
+    return path_base, path + extension
 
-    with open(path + extension) as f:
-        scanned = list(scanner.scan_text(f.read()))
+def imports(filename):
+    with open(filename) as f:
+        for line in f:
+            m = IMPORT.match(line)
+            if m is None:
+                continue
+            if m.group(2) is None:
+                yield m.group(1)
+            else:
+                yield m.group(2) + '.' + m.group(1)
 
-    if os.path.isfile(os.path.join(path_base, samples, name)):
-        with open(os.path.join(path_base, samples, name)) as sample:
-            inp = sample.read()
+def prefetch(base, name, extension):
+    # imports are found with a regex over the raw text, so this may scan a few modules
+    # that are never imported; interpretation still loads them serially in order
+    found = {}
+    queue = [name]
+    while queue:
+        name = queue.pop()
+        if name in found or name in PREFETCHED or name == 'sys':
+            continue
+
+        path_base, filename = module_path(base, name, extension)
+        try:
+            queue.extend(imports(filename))
+        except OSError:
+            continue
+
+        found[name] = (path_base, name, filename)
+
+    if len(found) < 2 or (os.cpu_count() or 1) < 2:
+        return
+
+    with ProcessPoolExecutor() as pool:
+        futures = {name: pool.submit(scan, *args) for name, args in found.items()}
+        for name, future in futures.items():
+            try:
+                PREFETCHED[name] = future.result()
+            except Exception:
+                # left for the serial load to report, if the module is really imported
+                pass
+
+def open_input(f):
+    # mapped, so the program only pages in the input it reads
+    try:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError):
+        # pipes and empty files cannot be mapped, but still read on demand
+        return f
+    mapped.seek(f.tell())
+    return mapped
+
+# samples stay open until the whole program has run, since a module that
+# imported sys may still read its input after its own load is done
+SAMPLES = []
+
+def close_samples():
+    for sample in SAMPLES:
+        sample.close()
+    SAMPLES.clear()
+
+# a module's sample is a file, or a directory with one file per run
+def sample_input(path_base, samples, name, run=None):
+    path = os.path.join(path_base, samples, name)
+    if run is not None and os.path.isdir(path):
+        path = os.path.join(path, run)
+
+    if not os.path.isfile(path):
+        return b''
+
+    f = open(path, 'rb')
+    sample = open_input(f)
+    if sample is not f:
+        f.close()
+    SAMPLES.append(sample)
+    return sample
+
+def sample_runs(base, names, extension, samples):
+    runs = set()
+    for name in names:
+        path_base, _ = module_path(base, name, extension)
+        path = os.path.join(path_base, samples, name)
+        if os.path.isdir(path):
+            runs.update(run for run in os.listdir(path) if os.path.isfile(os.path.join(path, run)))
+    return sorted(runs)
+
+def load(modules, base, name, extension, samples, run=None):
+    if name in modules:
+        return
+
+    path_base, filename = module_path(base, name, extension)
+
+    if name in PREFETCHED:
+        scanned = PREFETCHED.pop(name)
     else:
-        inp = ''
+        scanned = scan(path_base, name, filename)
 
-    enrich_phrases(scanned, name)
-    modules[name] = scanned
+    inp = sample_input(path_base, samples, name, run)
 
-    for imp in interpreter.load_module(name, scanned):
+    modules[name] = scanner.index_blocks(scanned)
+
+    for imp in ENGINE.load_module(name, scanned):
         #interpreter.print_types()
         if imp.module == 'sys':
-            interpreter.Scope.MODULES['sys'] = interpreter._builtin_sys(inp).scope
+            ENGINE.add_sys(inp)
             continue
 
-        load(modules, base, imp.module, extension, samples)
+        load(modules, base, imp.module, extension, samples, run)
         #raise NotImplementedError("importing external modules not implemented")
 
-def loadabs(modules, filename, extension, samples):
+def sample_key(path_base, name, samples):
+    path = os.path.join(path_base, samples, name)
+    if os.path.isdir(path):
+        return '/'.join(run + '=' + sample_key(path, run, '') for run in sorted(os.listdir(path)))
+
+    try:
+        return file_key(name, path)
+    except OSError:
+        return ''
+
+def artifact_keys(base, name, extension, samples, keys=None):
+    # a module's key covers its source, its sample and the keys of everything
+    # it imports; imports come from the same regex as prefetch, so a few
+    # modules that are never loaded may be part of the key
+    if keys is None:
+        keys = {}
+    if name in keys or name == 'sys':
+        return keys
+
+    path_base, filename = module_path(base, name, extension)
+    try:
+        deps = sorted(set(imports(filename)))
+        source = file_key(name, filename)
+    except OSError:
+        return keys
+
+    keys[name] = None
+    for dep in deps:
+        artifact_keys(base, dep, extension, samples, keys)
+
+    h = hashlib.sha256()
+    for part in (TYPES_VERSION, ENGINE.__name__, str(interpreter.CONVERGE), source, sample_key(path_base, name, samples)):
+        h.update(part.encode() + b'\0')
+    for dep in deps:
+        # None while an import cycle is still being keyed
+        h.update((dep + ':' + (keys.get(dep) or '')).encode() + b'\0')
+    keys[name] = h.hexdigest()
+
+    return keys
+
+def owner(_id):
+    return _id.partition(':')[0].partition('[')[0]
+
+def artifact(name):
+    lib = interpreter.LIB
+    return {
+        'types': {_id: d for _id, d in lib.types.items() if owner(_id) == name},
+        'generators': {_id for _id in lib.generators if owner(_id) == name},
+        'func_args': {_id: a for _id, a in lib.func_args.items() if owner(_id) == name},
+        'args_cast': {_id: a for _id, a in lib.args_cast.items() if owner(_id) == name},
+        'interfaces': {_id: s for _id, s in lib.interfaces.items() if owner(_id) == name},
+        'containers': {k: tp for k, tp in builtin.Types.types.items() if owner(k.partition(':')[2]) == name},
+    }
+
+def restore_artifact(data):
+    lib = interpreter.LIB
+    lib.types.update(data['types'])
+    lib.generators.update(data['generators'])
+    lib.func_args.update(data['func_args'])
+    lib.args_cast.update(data['args_cast'])
+    lib.interfaces.update(data['interfaces'])
+    builtin.Types.types.update(data['containers'])
+
+def artifact_name(base, name, extension):
+    path_base, _ = module_path(base, name, extension)
+    return os.path.join(path_base, CACHE, name + '.types.pickle')
+
+def read_artifact(base, name, extension):
+    try:
+        with open(artifact_name(base, name, extension), 'rb') as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+def phrase_ids(phrases):
+    return [None if phrase.tree is None else phrase.tree.origin.phrase_id for phrase in phrases]
+
+def restore(modules, base, name, extension, keys):
+    # inference runs across module boundaries, so artifacts are only used
+    # when every module of the program is unchanged
+    root = read_artifact(base, name, extension)
+    if root is None or root[0] != keys.get(name):
+        return False
+
+    program, order = root[1], root[2]
+    artifacts = {}
+    for module in order:
+        cached = artifacts[module] = read_artifact(base, module, extension)
+        if cached is None or cached[0] != keys.get(module) or cached[1] != program:
+            return False
+
+    # the types are keyed by phrase id, so the scan must hand out the same ids
+    scanned = {}
+    for module in order:
+        path_base, filename = module_path(base, module, extension)
+        scanned[module] = scan(path_base, module, filename)
+        if phrase_ids(scanned[module]) != artifacts[module][3]:
+            return False
+
+    for module in order:
+        modules[module] = scanner.index_blocks(scanned[module])
+        restore_artifact(artifacts[module][4])
+    return True
+
+def store(modules, base, name, extension, keys):
+    program = keys[name]
+    order = list(modules)
+
+    for module in order:
+        if module not in keys:
+            continue
+
+        filename = artifact_name(base, module, extension)
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename + '.tmp', 'wb') as f:
+                pickle.dump((keys[module], program, order, phrase_ids(modules[module]), artifact(module)), f,
+                            pickle.HIGHEST_PROTOCOL)
+            os.replace(filename + '.tmp', filename)
+        except OSError:
+            pass
+
+class SampleError(Exception):
+    pass
+
+def describe(ex):
+    # the pool would format the traceback with linecache, which needs the
+    # stdlib tokenize this repo shadows; so frames are file and line only
+    frames = traceback.StackSummary.extract(traceback.walk_tb(ex.__traceback__), lookup_lines=False)
+    lines = [f'  File "{frame.filename}", line {frame.lineno}, in {frame.name}\n' for frame in frames]
+    return 'Traceback (most recent call last):\n' + ''.join(lines) + type(ex).__name__ + ': ' + str(ex)
+
+def infer_sample(base, name, extension, samples, run, engine, converge):
+    global ENGINE
+    try:
+        ENGINE = importlib.import_module(engine)
+        ENGINE.reset()
+        interpreter.CONVERGE = converge
+
+        modules = {}
+        try:
+            load(modules, base, name, extension, samples, run)
+        finally:
+            close_samples()
+    except Exception as ex:
+        return describe(ex)
+
+    lib = interpreter.LIB
+    return (list(modules), lib.types, lib.generators, lib.func_args, lib.args_cast, lib.interfaces,
+            builtin.Types.types)
+
+def merge_sample(modules, base, extension, result):
+    order, types, generators, func_args, args_cast, interfaces, containers = result
+    lib = interpreter.LIB
+
+    for name in order:
+        if name in modules:
+            continue
+        if name in PREFETCHED:
+            scanned = PREFETCHED.pop(name)
+        else:
+            path_base, filename = module_path(base, name, extension)
+            scanned = scan(path_base, name, filename)
+        modules[name] = scanner.index_blocks(scanned)
+
+    for scope_id, d in types.items():
+        lib.add_scope(scope_id)
+        for name, tp in d.items():
+            lib.update_type(scope_id, name, tp)
+
+    lib.generators.update(generators)
+    for _id, args in func_args.items():
+        assert lib.func_args.setdefault(_id, args) == args
+    for _id, casts in args_cast.items():
+        assert lib.args_cast.setdefault(_id, casts) == casts
+    for _id, implementations in interfaces.items():
+        lib.add_interface(_id)
+        lib.interfaces[_id].update(implementations)
+
+    for key, tp in containers.items():
+        old = builtin.Types.types.get(key)
+        builtin.Types.types[key] = tp if old is None else interpreter.Types.merge_types(old, tp)
+
+def load_samples(modules, base, name, extension, samples, runs):
+    # one process per sample; results are merged in sample name order, so the
+    # tables come out the same however the processes finish
+    args = (base, name, extension, samples)
+    with ProcessPoolExecutor() as pool:
+        futures = [pool.submit(infer_sample, *args, run, ENGINE.__name__, interpreter.CONVERGE) for run in runs]
+        for run, future in zip(runs, futures):
+            result = future.result()
+            if type(result) == str:
+                raise SampleError(f'sample {run} failed\n' + result)
+            merge_sample(modules, base, extension, result)
+
+def loadabs(modules, filename, extension, samples, artifacts=True):
     base, name = splitname(filename, extension)
-    return load(modules, base, name, extension, samples)
 
-def run(filename, extension, samples):
+    keys = artifact_keys(base, name, extension, samples)
+    if artifacts and restore(modules, base, name, extension, keys):
+        return
+
+    prefetch(base, name, extension)
+    runs = sample_runs(base, keys, extension, samples)
+    try:
+        if runs:
+            load_samples(modules, base, name, extension, samples, runs)
+        else:
+            load(modules, base, name, extension, samples)
+    finally:
+        close_samples()
+        # left over from the workers' runs, or found by the regex but never imported
+        PREFETCHED.clear()
+
+    if artifacts and name in keys:
+        store(modules, base, name, extension, keys)
+
+def infer(filename, extension, samples, inp=None, silent=False):
     import sys
     modules = {}
 
     base, name = splitname(filename, extension)
+    prefetch(base, name, extension)
 
-    with open(filename) as f:
-        scanned = list(scanner.scan_text(f.read()))
+    if name in PREFETCHED:
+        scanned = PREFETCHED.pop(name)
+    else:
+        scanned = scan(base, name, filename)
 
-    enrich_phrases(scanned, name)
-    modules[name] = scanned
+    modules[name] = scanner.index_blocks(scanned)
 
-    for imp in interpreter.load_module(name, scanned, False):
-        if imp.module == 'sys':
-            interpreter.Scope.MODULES['sys'] = interpreter._builtin_sys(sys.stdin.read()).scope
-            continue
+    try:
+        for imp in ENGINE.load_module(name, scanned, silent):
+            if imp.module == 'sys':
+                if inp is None:
+                    inp = open_input(sys.stdin.buffer)
+                ENGINE.add_sys(inp)
+                continue
+
+            try:
+                load(modules, base, imp.module, extension, samples)
+                continue
+            except FileNotFoundError:
+                pass
+
+            raise NotImplementedError("importing external modules not implemented")
+    finally:
+        close_samples()
+        PREFETCHED.clear()
+
+    return modules
 
+def profile(filename, extension, samples):
+    global ENGINE
+    ENGINE = interpreter
+    interpreter.PROFILE = True
+
+    base, name = splitname(filename, extension)
+    runs = sample_runs(base, artifact_keys(base, name, extension, samples), extension, samples) or [None]
+
+    # counts are kept by module and phrase index, with the module's source key
+    # so a profile of an older version is not applied to a newer one
+    counts = {}
+    for run in runs:
+        interpreter.reset()
+        modules = {}
         try:
-            load(modules, base, imp.module, extension, samples)
-            continue
-        except FileNotFoundError:
-            pass
+            load(modules, base, name, extension, samples, run)
+        finally:
+            close_samples()
+
+        for module, phrases in modules.items():
+            if module not in counts:
+                _, filename = module_path(base, module, extension)
+                counts[module] = {'key': file_key(module, filename), 'phrases': {}, 'calls': {}}
+
+            for table, found in (('phrases', interpreter.PHRASE_COUNTS), ('calls', interpreter.CALL_COUNTS)):
+                d = counts[module][table]
+                for i, phrase in enumerate(phrases):
+                    if phrase in found:
+                        d[i] = d.get(i, 0) + found[phrase]
 
-        raise NotImplementedError("importing external modules not implemented")
+    return counts
+
+def run(filename, extension, samples, stats=False):
+    infer(filename, extension, samples)
 
     interpreter.print_types()
+    if stats:
+        interpreter.print_observations()
+
+def verify(filename, extension, samples, converge, engine=interpreter):
+    global ENGINE
+    import sys
+    import time
+
+    inp = sys.stdin.buffer.read()
+
+    start = time.time()
+    infer(filename, extension, samples, inp, True)
+    full, containers = interpreter.LIB, builtin.Types.types
+    full_time = time.time() - start
+
+    if engine == abstract:
+        abstract.reset()
+        ENGINE = abstract
+        label = 'abstract'
+    else:
+        interpreter.reset()
+        interpreter.CONVERGE = converge
+        label = 'converged'
+
+    start = time.time()
+    infer(filename, extension, samples, inp, True)
+    other_time = time.time() - start
+
+    same = full.same(interpreter.LIB) and containers == builtin.Types.types
+    print('full run %.2fs, %s run %.2fs: types %s' % (full_time, label, other_time, 'same' if same else 'DIFFER'),
+          file=sys.stderr)
+    return same
 
 def main():
+    global ENGINE
     import argparse
 
     parser = argparse.ArgumentParser()
@@ -94,11 +587,32 @@ def main():
     parser.add_argument('--samples', default='samples.hut')
     parser.add_argument('--run', dest='run', action='store_true')
     parser.add_argument('--no-run', dest='run', action='store_false')
+    parser.add_argument('--stats', action='store_true')
+    parser.add_argument('--converge', type=int, default=None)
+    parser.add_argument('--verify', action='store_true')
+    parser.add_argument('--abstract', action='store_true')
+    parser.add_argument('--profile', default=None)
     parser.set_defaults(run=False)
     args = parser.parse_args()
 
+    if args.profile is not None:
+        counts = profile(args.filename, args.extension, args.samples)
+        with open(args.profile, 'w') as f:
+            json.dump(counts, f)
+        return
+
+    if args.verify:
+        engine = abstract if args.abstract else interpreter
+        if not verify(args.filename, args.extension, args.samples, args.converge or CONVERGE, engine):
+            raise SystemExit(1)
+        return
+
+    interpreter.CONVERGE = args.converge
+    if args.abstract:
+        ENGINE = abstract
+
     if args.run:
-        run(args.filename, args.extension, args.samples)
+        run(args.filename, args.extension, args.samples, args.stats)
     else:
         loadabs({}, args.filename, args.extension, args.samples)
 
@@ -2,333 +2,251 @@ import tokenize
 import sys
 
 class TokenGroup:
-    def __init__(self, name, items):
+    __slots__ = ('name', 'inner', 'origin')
+
+    def __init__(self, name, items, origin=None):
         self.name = name
         self.inner = items
-
-def close_bracket(tokens, i):
-    BRACKETS = {'(': ')', '{': '}', '[': ']'}
-    brackets = []
-    
-    assert tokens and tokens[i].name == 'open'
-    os = tokens[i].content
-    cs = BRACKETS[tokens[i].content]
-    level = 0
-
-    for i in range(i, len(tokens)):
-        token = tokens[i]
-
-        if token.name == 'open' and token.content == os:
-            level += 1
-        elif token.name == 'close' and token.content == cs:
-            level -= 1
-            if level == 0:
-                return i
-
-    return -1
-
-def _group_brackets(groups):
-    BRACKETS = {'(': ')', '{': '}', '[': ']'}
-    i = -1
-
-    while i + 1 < len(groups):
-        i += 1
-        if groups[i].name == 'open':
-            j = close_bracket(groups, i)
-            assert j >= 0
-            yield TokenGroup(groups[i].content + BRACKETS[groups[i].content], groups[i+1:j])
-            i = j
-        else:
-            yield groups[i]
-
-def group_brackets(groups):
-    return list(_group_brackets(groups))
-
-def group_call_index(groups):
-    output = []
-    TYPES = {'()': 'call', '[]': 'index'}
-
-    i = -1
-    while i + 1 < len(groups):
-        i += 1
-        if groups[i].name in TYPES and i and output[-1].name in ('name', 'call', 'index', '()'):
-            output[-1] = TokenGroup(TYPES[groups[i].name], output[-1:] + groups[i:i + 1])
-        else:
-            output.append(groups[i])
-
-    return output
-
-def group_attr(groups):
-    output = []
-
-    i = -1
-    while i + 1 < len(groups):
-        i += 1
-        if len(output) > 1 and output[-1].name == 'sign' and output[-1].content == '.':
-            output[-2] = TokenGroup('attr', output[-2:] + groups[i:i + 1])
-            output.pop()
-        else:
-            output.append(groups[i])
-
-    return output
-
-def switch_attr(groups):
-    output = []
-
-    i = -1
-    while i + 1 < len(groups):
-        i += 1
-        if groups[i].name == 'attr' and groups[i].inner[-1].name in ('call', 'index'):
-            attr = TokenGroup('attr', groups[i].inner[:-1] + groups[i].inner[-1].inner[:1])
-            call = TokenGroup(groups[i].inner[-1].name, [attr, groups[i].inner[-1].inner[1]])
-            output.append(call)
+        self.origin = origin
+
+    @property
+    def phrase_id(self):
+        return self.origin.phrase_id
+
+    def __reduce__(self):
+        return TokenGroup, (self.name, self.inner, self.origin)
+
+ASSIGNMENTS = ('=', '+=', '-=', '/=', '*=', '%=', '|=', '&=', '^=', '~=')
+COMPARISONS = ('<=', '>=', '==', '!=', '<', '>')
+UNARY = ('-', '~', '+')
+CALL_INDEX = {'(': 'call', '[': 'index'}
+CALLABLE = ('name', 'call', 'index', '()')
+
+# binding levels, loosest first; lists and assignments swap the two outer levels in assignment lists
+OUTER, INNER, PAIR, RANGE, AND_OR, NOT, COMPARE, IS, PLUS_MINUS, MUL_DIV, PREFIX = range(1, 12)
+
+BINARY = {'/': MUL_DIV, '*': MUL_DIV, '%': MUL_DIV, '|': MUL_DIV, '&': MUL_DIV,
+          '+': PLUS_MINUS, '-': PLUS_MINUS, '^': PLUS_MINUS}
+BINARY.update((sign, COMPARE) for sign in COMPARISONS)
+
+class Parser:
+    def __init__(self, tokens, assignment_list):
+        self.tokens = tokens
+        self.n = len(tokens)
+        self.i = 0
+        self.ranges = False
+        self.origin = tokens[0].origin if tokens else None
+
+        if assignment_list:
+            self.list_level, self.assign_level = OUTER, INNER
         else:
-            output.append(groups[i])
-
-    return output
-
-def group_unary(groups):
-    output = []
-
-    if groups:
-        output.append(groups[0])
-
-    i = 0
-    while i + 1 < len(groups):
-        i += 1
-        if  (len(output) < 2 or output[-2].name == 'sign') and output[-1].name == 'sign' and output[-1].content in '-~+':
-            output[-1] = TokenGroup('unary', output[-1:] + groups[i:i + 1])
+            self.list_level, self.assign_level = INNER, OUTER
+
+    def peek(self, k=0):
+        if self.i + k < self.n:
+            return self.tokens[self.i + k]
+        return None
+
+    def can_start(self, k=0):
+        token = self.peek(k)
+        return token is not None and token.name != 'close'
+
+    def infix(self, token):
+        if token.name == 'sign':
+            if token.content in BINARY:
+                return BINARY[token.content]
+            if token.content == ':' and self.ranges:
+                return RANGE
+            if token.content == ',':
+                return self.list_level
+            if token.content in ASSIGNMENTS:
+                return self.assign_level
+        elif token.name == 'keyword':
+            if token.content == 'and' or token.content == 'or':
+                return AND_OR
+            if token.content == 'is':
+                return IS
+            if token.content == 'in':
+                return self.assign_level
+        return 0
+
+    def continues(self, k):
+        token = self.peek(k)
+        if token is None:
+            return False
+        if token.name == 'open':
+            return token.content in CALL_INDEX
+        if token.name == 'sign' and token.content == '.':
+            return True
+        return self.infix(token) > PAIR
+
+    def sequence(self):
+        groups = []
+        while self.can_start():
+            groups.append(self.expression(OUTER))
+        return groups
+
+    def brackets(self):
+        opener = self.tokens[self.i]
+        self.i += 1
+
+        ranges = self.ranges
+        self.ranges = opener.content != '('
+        groups = self.sequence()
+        self.ranges = ranges
+
+        closer = self.tokens[self.i]
+        assert closer.content == tokenize.BRACKETS[opener.content]
+        self.i += 1
+
+        return TokenGroup(opener.content + closer.content, groups, self.origin)
+
+    def primary(self):
+        token = self.tokens[self.i]
+        if token.name == 'open':
+            group = self.brackets()
         else:
-            output.append(groups[i])
-
-    return output
+            group = token
+            self.i += 1
 
-def group_not(groups):
-    output = []
+        while group.name in CALLABLE:
+            token = self.peek()
+            if token is None or token.name != 'open' or token.content not in CALL_INDEX:
+                break
+            group = TokenGroup(CALL_INDEX[token.content], [group, self.brackets()], self.origin)
 
-    i = -1
-    while i + 1 < len(groups):
-        i += 1
-        if i and (output[-1].name == 'keyword' and output[-1].content == 'not'):
-            output[-1] = TokenGroup('unary', output[-1:] + groups[i:i + 1])
-        else:
-            output.append(groups[i])
+        return group
 
-    return output
+    def attr(self):
+        left = self.primary()
 
-def group_binary_mul_div(groups):
-    output = []
+        while True:
+            dot = self.peek()
+            if dot is None or dot.name != 'sign' or dot.content != '.' or not self.can_start(1):
+                return left
 
-    i = -1
-    while i + 1 < len(groups):
-        i += 1
-        if len(output) > 1 and output[-1].name == 'sign' and output[-1].content in '/*%|&':
-            output[-2] = TokenGroup('binary', output[-2:] + groups[i:i + 1])
-            output.pop()
-        else:
-            output.append(groups[i])
-
-    return output
-
-def group_binary_plus_minus(groups):
-    output = []
-
-    i = -1
-    while i + 1 < len(groups):
-        i += 1
-        if len(output) > 1 and output[-1].name == 'sign' and output[-1].content in '+-^':
-            output[-2] = TokenGroup('binary', output[-2:] + groups[i:i + 1])
-            output.pop()
-        else:
-            output.append(groups[i])
-
-    return output
-
-def group_binary_is_in(groups):
-    output = []
-    last_is = -2
-
-    i = -1
-    while i + 1 < len(groups):
-        i += 1
-        if groups[i].name == 'keyword' and groups[i].content == 'is':
-            assert i > 0 and last_is < 0
-            last_is = i
-            output.append(groups[i])
-        elif last_is == i - 1 and groups[i].name == 'keyword' and groups[i].content == 'not':
-            assert output[-1].content == 'is'
-            last_is = i
-            #output[-1].name = 'is not'
-            output[-1].content = 'is not'
-        elif last_is == i - 1 and groups[i].name == 'keyword' and groups[i].content == 'in':
-            #output[-1].name += ' in'
-            output[-1].content += ' in'
-        elif last_is >= 0:
-            output[-2] = TokenGroup('binary', output[-2:] + groups[i:i + 1])
-            last_is = -2
-            output.pop()
-        else:
-            output.append(groups[i])
+            self.i += 1
+            right = self.primary()
 
-    return output
-
-def group_compare(groups):
-    output = []
-
-    i = -1
-    while i + 1 < len(groups):
-        i += 1
-        if len(output) > 1 and output[-1].name == 'sign' and output[-1].content in ('<=', '>=', '==', '!=', '<', '>'):
-            output[-2] = TokenGroup('compare', output[-2:] + groups[i:i + 1])
-            output.pop()
-        else:
-            output.append(groups[i])
-
-    return output
-
-def group_binary_and_or(groups):
-    output = []
-
-    i = -1
-    while i + 1 < len(groups):
-        i += 1
-        if len(output) > 1 and output[-1].name == 'keyword' and output[-1].content in ('and', 'or'):
-            output[-2] = TokenGroup('binary', output[-2:] + groups[i:i + 1])
-            output.pop()
-        else:
-            output.append(groups[i])
-
-    return output
-
-def group_binary_unary(groups):
-    groups = group_unary(groups)
-    groups = group_binary_mul_div(groups)
-    groups = group_binary_plus_minus(groups)
-    groups = group_binary_is_in(groups)
-    groups = group_compare(groups)
-    groups = group_not(groups)
-    groups = group_binary_and_or(groups)
-
-    return groups
-
-def group_pairs(groups):
-    output = []
-
-    i = -1
-    while i + 1 < len(groups):
-        i += 1
-        if i and groups[i].name == 'name' and i > 0 and output[-1].name == 'name':
-            output[-1] = TokenGroup('pair', [output[-1], groups[i]])
-        else:
-            output.append(groups[i])
-
-    return output
-
-
-def group_list(groups):
-    output = []
-    open_list = False
-
-    i = -1
-    while i + 1 < len(groups):
-        i += 1
-        if i and groups[i].name == 'sign' and groups[i].content == ',':
-            if output[-1].name != 'list':
-                output[-1] = TokenGroup('list', output[-1:])
-            open_list = True
-        elif open_list:
-            output[-1].inner.append(groups[i])
-            open_list = False
-        else:
-            output.append(groups[i])
-
-    return output
-
-def group_range(groups):
-    output = []
-    range_next = False
-
-    i = -1
-    while i + 1 < len(groups):
-        i += 1
-        if range_next:
-            output[-1].inner.append(groups[i])
-            range_next = (groups[i].name == 'sign' and groups[i].content == ':')
-        elif groups[i].name == 'sign' and groups[i].content == ':':
-            range_next = True
-            if len(output) > 0:
-                if output[-1].name == 'range':
-                    output[-1].inner.append(groups[i])
+            if right.name == 'call' or right.name == 'index':
+                attr = TokenGroup('attr', [left, dot, right.inner[0]], self.origin)
+                left = TokenGroup(right.name, [attr, right.inner[1]], self.origin)
+            else:
+                left = TokenGroup('attr', [left, dot, right], self.origin)
+
+    def prefix(self):
+        token = self.tokens[self.i]
+
+        if token.name == 'sign' and token.content in UNARY and self.can_start(1):
+            self.i += 1
+            return TokenGroup('unary', [token, self.expression(PREFIX)], self.origin)
+        if token.name == 'keyword' and token.content == 'not' and self.can_start(1):
+            self.i += 1
+            return TokenGroup('unary', [token, self.expression(NOT + 1)], self.origin)
+        if token.name == 'sign' and token.content == ':' and self.ranges:
+            return self.range(None)
+
+        return self.attr()
+
+    def range(self, left):
+        items = [] if left is None else [left]
+
+        while True:
+            colon = self.peek()
+            if colon is None or colon.name != 'sign' or colon.content != ':':
+                break
+
+            items.append(colon)
+            self.i += 1
+
+            token = self.peek()
+            if not self.can_start() or (token.name == 'sign' and token.content in (':', ',')):
+                continue
+            items.append(self.expression(RANGE + 1))
+
+        return TokenGroup('range', items, self.origin)
+
+    def list(self, left):
+        items = [left]
+
+        while True:
+            comma = self.peek()
+            if comma is None or comma.name != 'sign' or comma.content != ',':
+                break
+
+            self.i += 1
+            if self.can_start() and not (self.peek().name == 'sign' and self.peek().content == ','):
+                items.append(self.expression(self.list_level + 1))
+
+        return TokenGroup('list', items, self.origin)
+
+    def is_sign(self, token):
+        content = 'is'
+        if self.peek() is not None and self.peek().name == 'keyword' and self.peek().content == 'not':
+            content += ' not'
+            self.i += 1
+        if self.peek() is not None and self.peek().name == 'keyword' and self.peek().content == 'in':
+            content += ' in'
+            self.i += 1
+
+        if content == token.content:
+            return token
+        return tokenize.Token('keyword', content, token.i, token.origin)
+
+    def expression(self, level):
+        left = self.prefix()
+
+        while True:
+            token = self.peek()
+            if token is None:
+                return left
+
+            binding = self.infix(token)
+
+            if binding == RANGE:
+                if binding < level:
+                    return left
+                left = self.range(left)
+            elif binding == self.list_level and token.content == ',':
+                if binding < level:
+                    return left
+                left = self.list(left)
+            elif binding:
+                if binding < level or not self.can_start(1):
+                    return left
+
+                start = self.i
+                self.i += 1
+                if binding == IS:
+                    token = self.is_sign(token)
+                    if not self.can_start():
+                        self.i = start
+                        return left
+
+                if binding == COMPARE:
+                    name = 'compare'
+                elif binding == self.assign_level:
+                    name = 'assignment'
                 else:
-                    output[-1] = TokenGroup('range', [output[-1], groups[i]])
+                    name = 'binary'
+
+                left = TokenGroup(name, [left, token, self.expression(binding + 1)], self.origin)
+            elif PAIR >= level and token.name == 'name' and type(left) == tokenize.Token and left.name == 'name':
+                if self.continues(1):
+                    return left
+                self.i += 1
+                left = TokenGroup('pair', [left, token], self.origin)
             else:
-                output.append(TokenGroup('range', [groups[i]]))
-        else:
-            output.append(groups[i])
-
-    return output
-
-def _is_assign(sign):
-    if sign.name == 'sign' and sign.content in ('=', '+=', '-=', '/=', '*=', '%=', '|=', '&=', '^=', '~='):
-        return True
-    if sign.name == 'keyword' and sign.content == 'in':
-        return True
-    return False
-
-def group_assignment(groups):
-    output = []
-
-    i = -1
-    while i + 1 < len(groups):
-        i += 1
-        if len(output) > 1 and _is_assign(output[-1]):
-            output[-2] = TokenGroup('assignment', output[-2:] + groups[i:i + 1])
-            output.pop()
-        else:
-            output.append(groups[i])
-
-    return output
-
-def recursive(f, groups):
-    groups = f(groups)
-    for g in groups:
-        if type(g) == TokenGroup:
-            g.inner = recursive(f, g.inner)
-    return groups
+                return left
 
-def recursive_post(f, groups):
-    for g in groups:
-        if type(g) == TokenGroup:
-            g.inner = recursive_post(f, g.inner)
-    return f(groups)
-
-def recursive_restricted(f, groups, when):
-    for g in groups:
-        if type(g) == TokenGroup:
-            recursive_restricted(f, g.inner, when)
-    for g in groups:
-        if g.name in when:
-            g.inner = f(g.inner)
-
-def tree(s, assignment_list=False):
-    tokens = tokenize.tokenize(s)
-    groups = recursive(group_brackets, list(tokens))
-    groups = recursive_post(group_call_index, groups)
-    groups = recursive_post(group_attr, groups)
-    groups = recursive_post(switch_attr, groups)
-    groups = recursive_post(group_binary_unary, groups)
-    recursive_restricted(group_range, groups, ('[]', '{}'))
-    groups = recursive_post(group_pairs, groups)
-    if assignment_list:
-        groups = recursive_post(group_assignment, groups)
-        groups = recursive_post(group_list, groups)
-    else:
-        groups = recursive_post(group_list, groups)
-        groups = recursive_post(group_assignment, groups)
+def tree(tokens, assignment_list=False):
+    parser = Parser(tokens, assignment_list)
+    groups = parser.sequence()
+    assert parser.i == parser.n
     return groups
 
-def root(s, assignment_list=False):
-    treelist = tree(s, assignment_list=assignment_list)
+def root(tokens, assignment_list=False):
+    treelist = tree(tokens, assignment_list=assignment_list)
     assert len(treelist) == 1, '$'.join(t.name for t in treelist)
     return treelist[0]
 
@@ -343,6 +261,6 @@ def print_tree(groups):
     print(', '.join(_print_tree(groups)))
 
 if __name__ == "__main__":
-    for phrase in tokenize.sentenize(sys.stdin.read()):
-        print('"' + phrase + '"')
-        print_tree(tree(phrase))
+    for sentence in tokenize.lex(sys.stdin.read()):
+        print('"' + sentence.text + '"')
+        print_tree(tree(sentence.tokens))
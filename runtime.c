@@ -569,32 +569,75 @@ bool RT_RANGE_NOTDONE(struct thread *thread, struct range *range)
     return range->i < range->j;
 }
 
-struct str_obj *rt_read_input(struct thread *thread)
+// stdin is read into one growing buffer, which becomes the string at the end
+static unsigned char *rt_grow_buffer(unsigned char *buff, size_t *size)
 {
-    unsigned char buff[256];
-    ssize_t n = fread(buff, 1, sizeof(buff), stdin);
+    *size *= 2;
+    unsigned char *grown = realloc(buff, *size + 1);
+    if (!grown)
+        EXIT();
+    return grown;
+}
 
-    if (n <= 0)
-        return rt_chars_to_str(thread, (unsigned char *)"", 0);
+static struct str_obj *rt_buffer_to_str(struct thread *thread, unsigned char *buff, size_t n)
+{
+    struct str_obj *s = NEW(str_obj);
 
-    struct str_obj *s = rt_chars_to_str(thread, buff, n);
+    s->obj.free = (delete)rt_str_free;
+    s->str.s = buff;
+    s->str.n = n;
+    s->str.s[n] = '\0';
 
-    if (n < sizeof(buff))
-        return s;
+    return s;
+}
 
-    while ((n = fread(buff, 1, sizeof(buff), stdin)) == sizeof(buff)) {
-        struct str_obj bo = {.str = {buff, n}};
-        rt_str_plus_equals(thread, s, &bo);
-    }
+struct str_obj *rt_read_all(struct thread *thread)
+{
+    size_t size = 256;
+    size_t n = 0;
+
+    unsigned char *buff = (unsigned char *)malloc(size + 1);
+    if (!buff)
+        EXIT();
 
-    if (n <= 0)
-        return s;
+    while ((n += fread(buff + n, 1, size - n, stdin)) == size)
+        buff = rt_grow_buffer(buff, &size);
 
-    struct str_obj bo = {.str = {buff, n}};
-    rt_str_plus_equals(thread, s, &bo);
+    return rt_buffer_to_str(thread, buff, n);
+}
+
+struct str_obj *rt_read_chunk(struct thread *thread, double n)
+{
+    struct str_obj *s = rt_str_junk(thread, n > 0 ? (size_t)n : 0);
+
+    s->str.n = fread(s->str.s, 1, s->str.n, stdin);
+    s->str.s[s->str.n] = '\0';
     return s;
 }
 
+struct str_obj *rt_read_line(struct thread *thread)
+{
+    size_t size = 256;
+    size_t n = 0;
+    int c = 0;
+
+    unsigned char *buff = (unsigned char *)malloc(size + 1);
+    if (!buff)
+        EXIT();
+
+    while (c != '\n' && (c = getc(stdin)) != EOF) {
+        if (n == size)
+            buff = rt_grow_buffer(buff, &size);
+        buff[n++] = c;
+    }
+
+    return rt_buffer_to_str(thread, buff, n);
+}
+
+// sys.stdin.read() reads to the end, sys.stdin.read(n) at most n bytes
+#define RT_READ_INPUT(thread, n, name, ...) name
+#define rt_read_input(...) RT_READ_INPUT(__VA_ARGS__, rt_read_chunk, rt_read_all)(__VA_ARGS__)
+
 void rt_print_str(struct thread *thread, char *fmt, struct str_obj *obj, bool error)
 {
     fprintf(error ? stderr : stdout, fmt, obj->str.s);
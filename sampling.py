@@ -0,0 +1,153 @@
+import interpreter
+import builtin
+import loader
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+def sample_files(filename, extension, samples):
+    base, name = loader.splitname(filename, extension)
+    path = os.path.join(base, samples, name)
+    if os.path.isdir(path):
+        return [os.path.join(path, run) for run in sorted(os.listdir(path))
+                if os.path.isfile(os.path.join(path, run))]
+    if os.path.isfile(path):
+        return [path]
+    return []
+
+def run_sample(filename, extension, samples, text):
+    interpreter.reset()
+    interpreter.COVERAGE = True
+
+    try:
+        modules = loader.infer(filename, extension, samples, text, True)
+    except Exception:
+        # a sample the program cannot run tells nothing about the types
+        return None
+
+    covered = set()
+    for name, phrases in modules.items():
+        for i, phrase in enumerate(phrases):
+            if phrase in interpreter.COVERED:
+                covered.add((name, i))
+
+    lib = interpreter.LIB
+    containers = builtin.Types.types
+    observations = set(interpreter.OBSERVATIONS)
+    observations.update(('', key, tp) for key, tp in containers.items())
+
+    result = (lib.types, lib.generators, lib.func_args, lib.args_cast, lib.interfaces, containers)
+    return covered, observations, result
+
+def run_samples(filename, extension, samples, texts):
+    if len(texts) < 2:
+        return [run_sample(filename, extension, samples, text) for text in texts]
+
+    args = (filename, extension, samples)
+    with ProcessPoolExecutor() as pool:
+        futures = [pool.submit(run_sample, *args, text) for text in texts]
+        return [future.result() for future in futures]
+
+def report(filename, extension, samples):
+    paths = sample_files(filename, extension, samples)
+    texts = []
+    for path in paths:
+        with open(path) as f:
+            texts.append(f.read())
+
+    runs = run_samples(filename, extension, samples, texts)
+
+    covered = {}
+    observed = {}
+    for path, run in zip(paths, runs):
+        if run is None:
+            continue
+        for phrase in run[0]:
+            covered[phrase] = covered.get(phrase, 0) + 1
+        for observation in run[1]:
+            observed[observation] = observed.get(observation, 0) + 1
+
+    for path, text, run in zip(paths, texts, runs):
+        if run is None:
+            print(path + ': failed')
+            continue
+        phrases = sum(1 for phrase in run[0] if covered[phrase] == 1)
+        observations = sum(1 for observation in run[1] if observed[observation] == 1)
+        print(path + ':', len(text), 'bytes,', len(run[0]), 'phrases,', len(run[1]), 'observations,',
+              phrases, 'phrases and', observations, 'observations no other sample has')
+
+    # phrases no sample runs have no types, and codegen is likely to fail on them
+    base, _ = loader.splitname(filename, extension)
+    for name in sorted({name for name, _ in covered}):
+        path_base, module_file = loader.module_path(base, name, extension)
+        for i, phrase in enumerate(loader.scan(path_base, name, module_file)):
+            if (name, i) not in covered:
+                print('not covered:', name + ':' + str(i), phrase.debug.strip())
+
+def keeps(target, run):
+    return run is not None and run[0] == target[0] and run[2] == target[2]
+
+def minimize(filename, extension, samples, text, bytewise=False):
+    # removes ever smaller chunks of lines (or bytes) as long as the sample
+    # still runs the same phrases and ends with the same types; candidates
+    # are tried in parallel but always accepted in order, so the result is
+    # the same however the processes finish
+    target = run_sample(filename, extension, samples, text)
+    if target is None:
+        raise ValueError('sample does not run')
+
+    units = list(text) if bytewise else text.splitlines(keepends=True)
+    batch = os.cpu_count() or 1
+    chunk = max(len(units) // 2, 1)
+
+    with ProcessPoolExecutor() as pool:
+        while True:
+            i = 0
+            while i < len(units):
+                starts = range(i, min(i + batch * chunk, len(units)), chunk)
+                candidates = [''.join(units[:j] + units[j + chunk:]) for j in starts]
+                futures = [pool.submit(run_sample, filename, extension, samples, c) for c in candidates]
+
+                for j, future in zip(starts, futures):
+                    if keeps(target, future.result()):
+                        del units[j:j + chunk]
+                        i = j
+                        break
+                else:
+                    i += batch * chunk
+
+            if chunk == 1:
+                break
+            chunk //= 2
+
+    return ''.join(units)
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filename')
+    parser.add_argument('--extension', default='.hut')
+    parser.add_argument('--samples', default='samples.hut')
+    parser.add_argument('--minimize', default=None)
+    parser.add_argument('--bytes', action='store_true')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    if args.minimize is None:
+        report(args.filename, args.extension, args.samples)
+        return
+
+    with open(args.minimize) as f:
+        text = f.read()
+    smaller = minimize(args.filename, args.extension, args.samples, text, args.bytes)
+    print(args.minimize + ':', len(text), '->', len(smaller), 'bytes', file=sys.stderr)
+
+    if args.output is None:
+        sys.stdout.write(smaller)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(smaller)
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,8 @@ import tokenize
 import parse
 
 class Phrase:
+    __slots__ = ('name', 'tree', 'level', 'debug', 'questions', 'end', 'next', 'orelse', 'has_yield')
+
     def __init__(self, name, tree, level, debug='', questions=None):
         self.name = name
         self.tree = tree
@@ -10,6 +12,15 @@ class Phrase:
         self.debug = debug
         self.questions = questions
 
+        # block structure, filled in by index_blocks
+        self.end = None
+        self.next = None
+        self.orelse = None
+        self.has_yield = None
+
+    def __reduce__(self):
+        return Phrase, (self.name, self.tree, self.level, self.debug, self.questions)
+
 class Pattern:
     def __init__(self, words, empty=False, colon=False, asslist=False, name=None):
         self.colon = colon
@@ -26,85 +37,148 @@ class Pattern:
         if name is not None:
             self.name = name
 
-    def match(self, lstrip, n):
-        s = lstrip
+    def match(self, text, tokens, level):
+        n = len(tokens)
+        k = 0
         questions = []
 
         for w in self.words:
-            left_right = s.split(maxsplit=1)
-            if len(left_right) == 1:
-                sw = left_right[0]
-                s = ''
-            else:
-                sw = left_right[0]
-                s = left_right[1]
+            if k == n:
+                return None
 
-            if sw and sw[-1] == ':':
-                s = ':' + s
-                sw = sw[:-1]
+            j = word_end(tokens, k)
+            if is_colon(tokens[j - 1]):
+                j -= 1
+            if j == k:
+                return None
 
             if w == '?':
-                if not sw:
-                    return None
-                questions.append(sw)
-                continue
-
-            if sw != w:
+                questions.append(text[tokens[k].i:end_of(tokens[j - 1])])
+            elif j != k + 1 or tokens[k].content != w:
                 return None
+            k = j
 
         if self.colon:
-            if s and s[-1] == ':':
-                s = s[:-1]
+            if n > k and is_colon(tokens[n - 1]):
+                n -= 1
             else:
                 return None
 
-        s = s.rstrip()
-        if self.empty and s:
+        if self.empty and n > k:
             return None
 
-        if s:
-            treelist = parse.tree(s, assignment_list=self.asslist)
+        if n > k:
+            treelist = parse.tree(tokens[k:n], assignment_list=self.asslist)
             if len(treelist) > 1:
                 return None
             tree = treelist[0]
         else:
             tree = None
 
-        return Phrase(self.name, tree, n - len(lstrip), lstrip, questions)
-
-def scan(phrases):
-    PATTERNS = [Pattern('while', colon=True), Pattern('if', colon=True), Pattern('elif', colon=True),
-                Pattern('else', empty=True, colon=True), Pattern('for', colon=True),
-                Pattern('try', empty=True, colon=True), Pattern('except', colon=True),
-                Pattern('with', colon=True), Pattern('return'), Pattern('unit', colon=True, asslist=True),
-                Pattern('unit', colon=False, asslist=True, name='interface-unit'),
-                Pattern('class', colon=True), Pattern('interface', colon=True), Pattern('raise'), Pattern(['yield', 'from']),
-                Pattern('yield'), Pattern('continue'), Pattern('break', empty=True), Pattern('cast', colon=True),
-                Pattern('pass', empty=True), Pattern('assert'), Pattern('import'), Pattern(['import', '?', 'from', '?'])]
-
-    for i, s in enumerate(phrases):
-        lstrip = s.lstrip()
-
-        if not lstrip or lstrip.isspace():
+        return Phrase(self.name, tree, level, text[level:], questions)
+
+def end_of(token):
+    return token.i + len(token.content)
+
+def is_colon(token):
+    return token.name == 'sign' and token.content == ':'
+
+def word_end(tokens, k):
+    end = end_of(tokens[k])
+    k += 1
+    while k < len(tokens) and tokens[k].i == end:
+        end = end_of(tokens[k])
+        k += 1
+    return k
+
+PATTERNS = [Pattern('while', colon=True), Pattern('if', colon=True), Pattern('elif', colon=True),
+            Pattern('else', empty=True, colon=True), Pattern('for', colon=True),
+            Pattern('try', empty=True, colon=True), Pattern('except', colon=True),
+            Pattern('with', colon=True), Pattern('return'), Pattern('unit', colon=True, asslist=True),
+            Pattern('unit', colon=False, asslist=True, name='interface-unit'),
+            Pattern('class', colon=True), Pattern('interface', colon=True), Pattern('raise'), Pattern(['yield', 'from']),
+            Pattern('yield'), Pattern('continue'), Pattern('break', empty=True), Pattern('cast', colon=True),
+            Pattern('pass', empty=True), Pattern('assert'), Pattern('import'), Pattern(['import', '?', 'from', '?'])]
+
+# patterns sharing a first word, in the order they are tried
+DISPATCH = {}
+for pattern in PATTERNS:
+    DISPATCH.setdefault(pattern.words[0], []).append(pattern)
+
+def scan(sentences):
+    for sentence in sentences:
+        if not sentence.tokens:
             continue
 
-        for pattern in PATTERNS:
-            phrase = pattern.match(lstrip, len(s))
+        s = sentence.text
+        level = sentence.tokens[0].i
+
+        phrase = None
+        for pattern in DISPATCH.get(sentence.tokens[0].content, ()):
+            phrase = pattern.match(s, sentence.tokens, level)
             if phrase is not None:
                 break
 
         if phrase is not None:
             yield phrase
         else:
-            yield Phrase('expr', parse.root(lstrip.rstrip()), len(s) - len(lstrip), lstrip)
+            yield Phrase('expr', parse.root(sentence.tokens), level, s[level:])
+
+def index_blocks(phrases):
+    n = len(phrases)
+
+    # the last phrase before the level drops below that of each phrase
+    run = [n - 1] * n
+    stack = []
+    for k, phrase in enumerate(phrases):
+        while stack and phrases[stack[-1]].level > phrase.level:
+            run[stack.pop()] = k - 1
+        stack.append(k)
+
+    for k, phrase in enumerate(phrases):
+        if k + 1 < n and phrases[k + 1].level > phrase.level:
+            phrase.end = run[k + 1]
+        else:
+            phrase.end = k
+
+    for k, phrase in enumerate(phrases):
+        after = phrase.end + 1
+        phrase.next = after if after < n and phrases[after].level == phrase.level else -1
+
+        phrase.orelse = -1
+        if phrase.name in ('if', 'elif') and phrase.next >= 0 and phrases[phrase.next].name in ('elif', 'else'):
+            phrase.orelse = phrase.next
+
+        phrase.has_yield = False
+
+    # yields of nested units and classes belong to them
+    for k, phrase in enumerate(phrases):
+        if phrase.name != 'unit':
+            continue
+
+        m = k + 1
+        while m <= phrase.end:
+            inner = phrases[m]
+            if inner.name.startswith('yield'):
+                phrase.has_yield = True
+                break
+            if inner.name == 'unit' or inner.name == 'class':
+                m = inner.end + 1
+            else:
+                m += 1
+
+    return phrases
 
 def scan_text(s):
-    return scan(tokenize.sentenize(s))
+    return scan(tokenize.lex(s))
+
+def scan_file(f):
+    return scan(tokenize.lex_file(f))
 
 if __name__ == "__main__":
-    for phrase in tokenize.sentenize(sys.stdin.read()):
-        print(phrase)
-        scanned = list(scan([phrase]))
+    for sentence in tokenize.lex(sys.stdin.read()):
+        print(sentence.text)
+        scanned = list(scan([sentence]))
         if scanned:
             print(scanned[0].name)
         else:
@@ -1,18 +1,41 @@
 import sys
+from sys import intern
 
 KEYWORDS = {'and', 'if', 'or', 'not', 'while', 'for', 'in', 'import', 'class', 'unit', 'else', 'True', 'False', 'None', 'is'}
+BRACKETS = {'(': ')', '{': '}', '[': ']'}
 
 def contains(container, item):
     return item in container
 
+class Origin:
+    __slots__ = ('phrase_id', 'index')
+
+    def __init__(self, phrase_id=None, index=None):
+        self.phrase_id = phrase_id
+        self.index = index
+
+    def __reduce__(self):
+        return Origin, (self.phrase_id, self.index)
+
 class Token:
-    def __init__(self, name, content, i):
+    __slots__ = ('name', 'content', 'i', 'origin')
+
+    def __init__(self, name, content, i, origin=None):
         if name == 'name' and contains(KEYWORDS, content):
             self.name = 'keyword'
         else:
             self.name = name
         self.content = content
         self.i = i
+        self.origin = origin
+
+    @property
+    def phrase_id(self):
+        return self.origin.phrase_id
+
+    def __reduce__(self):
+        return Token, (self.name, self.content, self.i, self.origin)
+
  
 def next_char(s, i):
     for j in range(i + 1, len(s)):
@@ -26,144 +49,171 @@ def next_char_inline(s, i):
             return s[j], j
     return '', -1
 
-def sentenize(s):
-    BRACKETS = {'(': ')', '{': '}', '[': ']'}
+SPACE, NEWLINE, DIGIT, NAME, QUOTE, OPEN, CLOSE, COMMENT, COLON, PUNCT, OPERATOR = range(11)
 
-    where = ''
-    opener = ''
-    escape = False
-    brackets = []
-    start = 0
+def char_classes():
+    classes = {' ': SPACE, '\t': SPACE, '\n': NEWLINE, '#': COMMENT, ':': COLON, '"': QUOTE, "'": QUOTE}
+
+    for c in '0123456789':
+        classes[c] = DIGIT
+    for c in 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_':
+        classes[c] = NAME
+    for c in BRACKETS:
+        classes[c] = OPEN
+    for c in BRACKETS.values():
+        classes[c] = CLOSE
+    for c in ',.':
+        classes[c] = PUNCT
+    for c in '/*&^%~=-+<>!|':
+        classes[c] = OPERATOR
+
+    return classes
 
-    yield_count = 0
+CLASSES = char_classes()
+NAME_CHARS = frozenset(c for c, kind in CLASSES.items() if kind == NAME or kind == DIGIT)
+DIGIT_CHARS = frozenset('0123456789.')
 
-    i = -1
-    while i + 1 < len(s):
-        i += 1
+class Sentence:
+    __slots__ = ('text', 'start', 'tokens')
+
+    def __init__(self, text, start, tokens):
+        self.text = text
+        self.start = start
+        self.tokens = tokens
+
+def close_string(s, i, opener, final=True):
+    n = len(s)
+    while i < n:
         c = s[i]
+        if c == '\\':
+            i += 2
+        elif c == opener:
+            _, j = next_char(s, i)
+            if j < 0 and not final:
+                return -1
+            if j < 0 or (s[j] != '"' and s[j] != "'"):
+                return i
+            i = j + 1
+        else:
+            i += 1
+    assert not final, 'unterminated string'
+    return -1
 
-        if where ==  '':
-            if c.isdigit() or (c.lower() >= 'a' and c.lower() <= 'z') or c == '_' or contains('=,.+-/*%^~|&!<>', c):
-                pass
-            elif c == '"' or c == "'":
-                where = 'string'
-                opener = c
-            elif contains(BRACKETS, c):
-                brackets.append(BRACKETS[c])
-            elif contains(BRACKETS.values(), c):
-                assert brackets.pop() == c
-            elif c == '#':
-                yield s[start:i]
-                yield_count += 1
-                where = 'comment'
-            elif c == '\n':
-                where = ''
-                yield s[start:i]
-                yield_count += 1
-                start = i + 1
-            elif c == ':':
-                if len(brackets) == 0:
-                    ch, j = next_char_inline(s, i)
-                    assert j < 0 or ch == '\n'
-                    yield s[start:i+1]
-                    yield_count += 1
-                    if j >= 0:
-                        start = j + 1
-                        i = j
-            else: 
-                assert c == ' ' or c == '\t', "unexpected '" + c + "' in phrase " + str(yield_count + 1)
-        elif where == 'string':
-            if escape:
-                escape = False
-            elif c == '\\':
-                escape = True
-            elif c == opener:
-                ch, j = next_char(s, i)
-                if ch != '"' and ch != "'":
-                    where = ''
-                    opener = ''
-                else:
-                    i = j
-        elif where == 'comment':
-            if c == '\n':
-                where = ''
-                start = i + 1
-
-    if where == '' and start < len(s):
-        yield s[start:]
-
-def tokenize(s):
-    BRACKETS = {'(': ')', '{': '}', '[': ']'}
-
-    where = ''
-    opener = ''
-    escape = False
+# lexes s into sentences; unless final, s is one piece of a longer text and
+# lexing stops at a sentence that may continue past its end, returning where it starts
+def lex(s, offset=0, final=True):
+    n = len(s)
+    tokens = []
+    origin = Origin()
     brackets = []
     start = 0
+    count = 0
 
-    i = -1
-    while i + 1 < len(s): 
-        i += 1
+    i = 0
+    while i < n:
         c = s[i]
-        if where ==  '':
-            if c.isdigit():
-                where, start = 'digit', i
-            elif (c.lower() >= 'a' and c.lower() <= 'z') or c == '_':
-                where, start = 'name', i
-            elif c == '"' or c == "'":
-                where, start = 'string', i
-                opener = c
-            elif contains(BRACKETS, c):
-                brackets.append(BRACKETS[c])
-                yield Token('open', c, i)
-            elif contains(BRACKETS.values(), c):
-                assert brackets.pop() == c
-                yield Token('close', c, i)
-            elif c == '#':
-                where, start = 'comment', i
-            elif contains(',.:', c):
-                yield Token('sign', c, i)
-            elif contains('/*&^%~=-+<>!', c):
-                if i + 1 < len(s) and s[i + 1] == '=':
-                    yield Token('sign', c + '=', i)
-                    i += 1
-                else:
-                    yield Token('sign', c, i)
+        kind = CLASSES.get(c)
+
+        if kind == SPACE:
+            i += 1
+        elif kind == NAME:
+            j = i + 1
+            while j < n and s[j] in NAME_CHARS:
+                j += 1
+            tokens.append(Token('name', intern(s[i:j]), i - start, origin))
+            i = j
+        elif kind == DIGIT:
+            j = i + 1
+            while j < n and s[j] in DIGIT_CHARS:
+                j += 1
+            tokens.append(Token('digit', intern(s[i:j]), i - start, origin))
+            i = j
+        elif kind == OPERATOR:
+            if i + 1 < n and s[i + 1] == '=':
+                tokens.append(Token('sign', c + '=', i - start, origin))
+                i += 2
             else:
-                assert c.isspace()
-        elif where == 'string':
-            if escape:
-                escape = False
-            elif c == '\\':
-                escape = True
-            elif c == opener:
-                ch, j = next_char(s, i)
-                if ch != '"' and ch != "'":
-                    where = ''
-                    opener = ''
-                    yield Token('string', s[start:i + 1], start)
-                else:
-                    i = j
-        elif where == 'comment':
-            if c == '\n':
-                where = ''
-        elif where == 'digit':
-            if not c.isdigit() and c != '.':
-                yield Token('digit', s[start:i], start)
-                where = ''
-                i -= 1
-        elif where == 'name':
-            if not c.isdigit() and (c.lower() < 'a' or c.lower() > 'z') and c != '_':
-                yield Token('name', s[start:i], start)
-                where = ''
-                i -= 1
-
-    assert where != 'string' and len(brackets) == 0
-    if where != '' and where != 'comment':
-        yield Token(where, s[start:], start)
+                tokens.append(Token('sign', c, i - start, origin))
+                i += 1
+        elif kind == PUNCT:
+            tokens.append(Token('sign', c, i - start, origin))
+            i += 1
+        elif kind == QUOTE:
+            j = close_string(s, i + 1, c, final)
+            if j < 0:
+                return start
+            tokens.append(Token('string', s[i:j + 1], i - start, origin))
+            i = j + 1
+        elif kind == OPEN:
+            brackets.append(BRACKETS[c])
+            tokens.append(Token('open', c, i - start, origin))
+            i += 1
+        elif kind == CLOSE:
+            assert brackets and brackets.pop() == c
+            tokens.append(Token('close', c, i - start, origin))
+            i += 1
+        elif kind == NEWLINE:
+            assert not brackets
+            yield Sentence(s[start:i], offset + start, tokens)
+            count += 1
+            tokens = []
+            origin = Origin()
+            start = i = i + 1
+        elif kind == COMMENT:
+            assert not brackets
+            yield Sentence(s[start:i], offset + start, tokens)
+            count += 1
+            tokens = []
+            origin = Origin()
+            j = s.find('\n', i)
+            if j < 0:
+                return n
+            start = i = j + 1
+        elif kind == COLON:
+            tokens.append(Token('sign', c, i - start, origin))
+            if brackets:
+                i += 1
+                continue
+            ch, j = next_char_inline(s, i)
+            assert j < 0 or ch == '\n'
+            yield Sentence(s[start:i + 1], offset + start, tokens)
+            count += 1
+            tokens = []
+            origin = Origin()
+            if j < 0:
+                return n
+            start = i = j + 1
+        else:
+            assert False, "unexpected '" + c + "' in phrase " + str(count + 1)
+
+    assert not brackets
+    if start < n:
+        assert final
+        yield Sentence(s[start:], offset + start, tokens)
+    return n
+
+def lex_file(f, size=1 << 16):
+    buf = ''
+    offset = 0
+
+    while True:
+        chunk = f.read(size)
+        if not chunk:
+            break
+
+        buf += chunk
+        cut = buf.rfind('\n') + 1
+        if cut == 0:
+            continue
+
+        done = yield from lex(buf[:cut], offset, False)
+        buf = buf[done:]
+        offset += done
+
+    yield from lex(buf, offset)
 
 if __name__ == "__main__":
-    for sentence in sentenize(sys.stdin.read()):
-        print(sentence)
-        for token in tokenize(sentence):
+    for sentence in lex(sys.stdin.read()):
+        print(sentence.text)
+        for token in sentence.tokens:
             print(token.name, '"' + token.content + '"')